@@ -1,16 +1,171 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from collections import namedtuple
+from collections import deque, namedtuple
+from functools import wraps
+from itertools import izip
 from operator import attrgetter
+from array import array
+from bisect import bisect_right
 import heapq
+import json
+import multiprocessing
+import Queue
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # Problem sizes less than this constant, will be addressed by DP
 MAX_ALLOWED_MEMORY = 20000000
+# The compact DP stores one bit per cell instead of a Python integer, so it can
+# address problems roughly 64 times bigger with the same memory
+MAX_ALLOWED_COMPACT_CELLS = 64*MAX_ALLOWED_MEMORY
+
+# Initial number of items at each side of the critical item used by the
+# core solver
+CORE_SIZE = 25
+
+# Number of critical items whose value is enumerated by EnumerativeBound
+ENUMERATED_ITEMS = 2
+
+# The branch and bound searches replace the capacity by the max reachable
+# weight when item_count*(capacity + 1) is less than this (about 0.2 seconds)
+REACHABLE_WEIGHT_CELLS = 2e9
+
+# Speed of each engine used by the cost model of hybrid_solver (DP cells or
+# branch and bound nodes per second), measured on the ks_* instances
+ENGINE_SPEED = {
+    'table': 1e6,
+    'compact': 1.2e7,
+    'numpy': 5e8,
+    'hirschberg': 6e6,
+    'value': 1.2e7,
+    'subset_sum': 5e9,
+    'core': 3.5e5,
+}
+# The branch and bound tree size is predicted as (number of combinations of
+# flipped items that may improve the greedy solution)**BB_EXPONENT, counted by
+# a DP over the LP gap split in PENALTY_BUCKETS buckets
+BB_EXPONENT = 0.5
+PENALTY_BUCKETS = 64
+# Items with a penalty near zero double the number of combinations each, but
+# the search does not need a node per combination, so the count is clamped
+# (1e14 combinations predict about 30 seconds of core solver, it took ~20 on a
+# random instance with 1M items)
+BB_MAX_COMBINATIONS = 1e14
+# Predicted and actual times of the last CALIBRATION_LOG_SIZE engines chosen
+# by hybrid_solver. If CALIBRATION_FILE is set, they are also appended to it
+# as JSON lines
+CALIBRATION_LOG_SIZE = 1000
+CALIBRATION_LOG = deque(maxlen=CALIBRATION_LOG_SIZE)
+CALIBRATION_FILE = None
+
+# Search engines that can be raced by Knapsack.portfolio_solver, besides 'dp'
+# (the DP backend, or the Hirschberg one if it is too big) and 'greedy'
+PORTFOLIO_ENGINES = {
+    'depth_first': 'lazy_depth_first_branch_bound',
+    'best_first': 'best_first_branch_bound',
+    'core': 'core_solver',
+}
+# Seconds between the checks of portfolio_solver for engines that died
+PORTFOLIO_POLL = 0.1
+
+# DP implementations that can be chosen through Knapsack(dp_backend=...)
+DP_BACKENDS = {
+    'table': 'dynamic_programming',
+    'compact': 'dynamic_programming_compact',
+    'numpy': 'dynamic_programming_numpy',
+    'hirschberg': 'dynamic_programming_hirschberg',
+    'sparse': 'dynamic_programming_sparse',
+    'bitset': 'dynamic_programming_bitset',
+    'value': 'dynamic_programming_by_value',
+    'subset_sum': 'subset_sum_bitset',
+}
+
+# Best solution found by an anytime search. bound is an upper bound of the
+# optimal value, and gap is (bound - value)/bound
+Incumbent = namedtuple("Incumbent", ['value', 'taken', 'bound', 'gap', 'optimal', 'nodes', 'elapsed'])
+
+Item = namedtuple("Item", ['index', 'value', 'weight'])
+
+# Item as used by the branch and bound methods (sorted by density)
+DensityItem = namedtuple("DensityItem", ['index', 'density', 'weight', 'value'])
+
+class ItemColumns(object):
+    """
+    Items stored as two columns (array('l') of values and weights) instead of
+    a list of Item tuples, as built by parse_instance. Indexing or iterating
+    it builds the Item tuples on demand, so the solvers can use it as the
+    item list, but loading an instance does not create a Python object per
+    item.
+    """
+    def __init__(self, values, weights):
+        self.values = values
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[j] for j in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return Item(index, self.values[index], self.weights[index])
+
+    def __iter__(self):
+        values = self.values
+        weights = self.weights
+        for index in xrange(len(values)):
+            yield Item(index, values[index], weights[index])
+
+def instance_columns(numbers):
+    """
+    Splits the numbers of an instance (item count, capacity, and then the
+    value and weight of each item) into (item_count, capacity, ItemColumns).
+    numbers may be a numpy array or an array('l'). Raises ValueError if some
+    of the items are missing.
+    """
+    if len(numbers) < 2:
+        raise ValueError('The instance has no item count and capacity')
+    item_count = int(numbers[0])
+    capacity = int(numbers[1])
+    if len(numbers) < 2 + 2*item_count:
+        raise ValueError('The instance has %d items, but only %d numbers for their values and weights' % (
+            item_count, len(numbers) - 2))
+    if np is not None and isinstance(numbers, np.ndarray):
+        numbers = array('l', numbers[:2 + 2*item_count].astype(np.int_).tostring())
+    values = numbers[2:2 + 2*item_count:2]
+    weights = numbers[3:3 + 2*item_count:2]
+    return item_count, capacity, ItemColumns(values, weights)
+
+def parse_instance(input_data):
+    """
+    Parses a knapsack instance (the first line has the item count and the
+    capacity, then one line per item with its value and weight) into
+    (item_count, capacity, ItemColumns). The numbers are parsed in bulk by
+    np.fromstring when numpy is available, and with a single split otherwise.
+    """
+    if np is not None:
+        return instance_columns(np.fromstring(input_data, dtype=np.int64, sep=' '))
+    return instance_columns(array('l', map(int, input_data.split())))
+
+def read_instance(file_location):
+    """
+    Same as parse_instance, but reading the instance from a file (the whole
+    file is read at once, np.fromfile is slower than parsing it).
+    """
+    with open(file_location, 'rb') as input_data_file:
+        return parse_instance(input_data_file.read())
 
 class Stack:
     """
-    Stack implementation, used for Depth First Branch and Bound
+    Stack implementation, used for Depth First Branch and Bound. The top of
+    the stack is the end of the list, so push and pop are O(1).
     """
     def __init__(self):
         self.stack = []
@@ -19,10 +174,10 @@ class Stack:
         return len(self.stack) == 0
 
     def push(self, e):
-        self.stack.insert(0, e)
+        self.stack.append(e)
 
     def pop(self):
-        return self.stack.pop(0)
+        return self.stack.pop()
 
     def __len__(self):
         return len(self.stack)
@@ -55,7 +210,189 @@ class PriorityQueue:
         return len(self.heap) == 0
 
 
+class SearchStats(object):
+    """
+    Counters of a search, kept in Knapsack.stats by every engine:
+
+    - expanded: nodes taken from the frontier (the node count of the budget).
+    - pruned_bound: nodes discarded because their estimate is not better than
+      the best solution found, pruned_infeasible: left children (item taken)
+      discarded because the item does not fit.
+    - max_frontier: largest size of the stack or priority queue.
+    - bound_time, bound_calls: time spent in the estimates (only measured if
+      the Knapsack was built with profile=True, see TimedBound).
+    - bound_tightened: estimates of a MartelloTothBound or EnumerativeBound
+      that are lower than the Dantzig bound of the same node.
+    - timeline: (elapsed, value) of each improvement of the incumbent.
+    - elapsed: total time of the engine.
+
+    The engines without a search tree (greedy and DP) only fill elapsed and
+    timeline. If log_interval is given, a line with the counters is written
+    with log (by default to stderr) every log_interval seconds of search.
+    """
+    def __init__(self, log_interval=None, log=None):
+        self.expanded = 0
+        self.pruned_bound = 0
+        self.pruned_infeasible = 0
+        self.max_frontier = 0
+        self.bound_time = 0.0
+        self.bound_calls = 0
+        self.bound_tightened = 0
+        self.timeline = []
+        self.elapsed = 0.0
+        # Set by the recorded decorator, for the engines without a search
+        self.recorded = False
+        self.log_interval = log_interval
+        self.log = log
+        self.last_log = 0.0
+
+    def improved(self, elapsed, value):
+        self.timeline.append((elapsed, value))
+
+    def add(self, other):
+        """
+        Adds the counters of the search of a subproblem (as the core solves
+        of core_solver).
+        """
+        self.expanded += other.expanded
+        self.pruned_bound += other.pruned_bound
+        self.pruned_infeasible += other.pruned_infeasible
+        self.max_frontier = max(self.max_frontier, other.max_frontier)
+        self.bound_time += other.bound_time
+        self.bound_calls += other.bound_calls
+        self.bound_tightened += other.bound_tightened
+
+    def periodic_log(self, elapsed):
+        if elapsed - self.last_log >= self.log_interval:
+            self.last_log = elapsed
+            self.elapsed = elapsed
+            line = str(self)
+            if self.log is not None:
+                self.log(line)
+            else:
+                sys.stderr.write(line + '\n')
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in [
+            'expanded', 'pruned_bound', 'pruned_infeasible', 'max_frontier',
+            'bound_time', 'bound_calls', 'bound_tightened', 'timeline', 'elapsed'])
+
+    def __str__(self):
+        best = self.timeline[-1][1] if self.timeline else None
+        return "%.2fs: best %s, expanded %d, pruned by bound %d, infeasible %d, max frontier %d, bound time %.2fs" % (
+            self.elapsed, best, self.expanded, self.pruned_bound, self.pruned_infeasible,
+            self.max_frontier, self.bound_time)
+
+class TimedBound(object):
+    """
+    Wraps a bound (as DantzigBound) to add the time spent in its estimates to
+    a SearchStats. It calls time.time() twice per estimate, so it is only
+    used when profiling.
+    """
+    def __init__(self, bound, stats):
+        self.bound = bound
+        self.stats = stats
+
+    def estimate(self, depth, room, value=0):
+        start = time.time()
+        estimate = self.bound.estimate(depth, room, value)
+        self.stats.bound_time += time.time() - start
+        self.stats.bound_calls += 1
+        return estimate
+
+def recorded(method):
+    """
+    Decorator of the engines that do not search a tree (greedy and DP), so
+    they also leave a SearchStats in Knapsack.stats, with their time and
+    final value. If the engine ran a search (e.g. dp_solver falling back to
+    a branch and bound), its stats are kept, but the ones left by the other
+    recorded engines it calls (as the greedy solutions used for pruning) are
+    replaced.
+    """
+    @wraps(method)
+    def engine(self, *args, **kwargs):
+        start = time.time()
+        self.stats = None
+        taken, value = method(self, *args, **kwargs)
+        if self.stats is None or self.stats.recorded:
+            self.stats = SearchStats(self.log_interval)
+            self.stats.recorded = True
+            self.stats.elapsed = time.time() - start
+            self.stats.improved(self.stats.elapsed, value)
+        return (taken, value)
+    return engine
+
+class SearchBudget(object):
+    """
+    Keeps track of the time and node limits of an anytime search, and builds
+    the Incumbent reports. The clock is only checked every CLOCK_CHECK_NODES
+    nodes, as time.time() is expensive compared to a node expansion. The
+    counters of the search are kept in stats (a SearchStats), which is also
+    logged periodically at the clock checks if it has a log_interval.
+    """
+    CLOCK_CHECK_NODES = 1024
+
+    def __init__(self, time_limit=None, node_limit=None, callback=None, stats=None):
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.callback = callback
+        self.stats = stats if stats is not None else SearchStats()
+        self.start = time.time()
+        self.nodes = 0
+        self.stopped = False
+        self.check_clock = time_limit is not None or self.stats.log_interval is not None
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def expired(self):
+        """
+        Counts a node, and returns True if the search must stop.
+        """
+        self.nodes += 1
+        if self.node_limit is not None and self.nodes > self.node_limit:
+            self.stopped = True
+        elif self.check_clock and self.nodes % self.CLOCK_CHECK_NODES == 0:
+            elapsed = self.elapsed()
+            if self.stats.log_interval is not None:
+                self.stats.expanded = self.nodes
+                self.stats.periodic_log(elapsed)
+            if self.time_limit is not None and elapsed > self.time_limit:
+                self.stopped = True
+        return self.stopped
+
+    def report(self, value, taken, bound, optimal=False):
+        bound = max(int(bound), value)
+        gap = (bound - value)/float(bound) if bound > 0 else 0.0
+        self.stats.expanded = self.nodes
+        self.stats.elapsed = self.elapsed()
+        return Incumbent(value, taken, bound, gap, optimal, self.nodes, self.stats.elapsed)
+
+    def improved(self, value, taken, bound):
+        """
+        Records an improvement of the incumbent. taken may be None when there
+        is no callback, so the engine does not need to build it.
+        """
+        self.stats.improved(self.elapsed(), value)
+        if self.callback is not None:
+            self.callback(self.report(value, taken, bound))
+
+    def finish(self, value, taken, root_bound, frontier):
+        """
+        Builds the final report. If the search was stopped, the best estimate
+        of the open nodes (frontier) gives a bound that is usually tighter than
+        the root one.
+        """
+        if not self.stopped:
+            return self.report(value, taken, value, True)
+        bound = root_bound
+        if frontier:
+            bound = min(bound, max(frontier))
+        return self.report(value, taken, bound)
+
 class KnapsackNode(object):
+    __slots__ = ('value', 'room', 'estimate', 'parent', 'assigned', 'depth', 'index')
+
     def __init__(self, value, room, estimate, parent=None, depth=0, index=None, assigned=0):
         self.value = value
         self.room = room
@@ -76,7 +413,91 @@ class KnapsackNode(object):
 
     def __str__(self):
         return "value: %d, room: %d, estimate: %.2f, item_id: %d, assigned: %d" % (
-            self.value, self.room, self.estimate, self.item_id, self.assigned)
+            self.value, self.room, self.estimate, self.index, self.assigned)
+
+
+class NodePool(object):
+    """
+    Stores the nodes of a branch and bound search tree as parallel arrays (one
+    column per attribute), so a node is just an integer id into the columns.
+    This avoids allocating a KnapsackNode per expansion, which takes a few
+    hundred bytes and puts pressure on the garbage collector, while a node in
+    the pool takes about 45 bytes. The item of a node is given by its depth
+    (items are visited in a fixed order), so it does not need to be stored.
+
+    A search calls release once it is done with a node (it was popped, and
+    its children pushed). Each node counts its references (itself until it
+    is released, and its children in the pool), and its id is only reused by
+    add when the count drops to zero, which releases its parent in turn. So
+    the parent ids of the nodes in the pool are always valid (taken and
+    assignment can be used on any of them), and the pool only takes memory
+    for the frontier and its ancestors.
+    """
+    def __init__(self):
+        self.value = array('l')
+        self.room = array('l')
+        self.estimate = array('d')
+        self.depth = array('l')
+        self.parent = array('l')
+        self.assigned = array('b')
+        self.references = array('l')
+        self.free = []
+
+    def add(self, value, room, estimate, parent=-1, depth=0, assigned=0):
+        if parent != -1:
+            self.references[parent] += 1
+        if self.free:
+            node = self.free.pop()
+            self.value[node] = value
+            self.room[node] = room
+            self.estimate[node] = estimate
+            self.depth[node] = depth
+            self.parent[node] = parent
+            self.assigned[node] = assigned
+            self.references[node] = 1
+            return node
+        self.value.append(value)
+        self.room.append(room)
+        self.estimate.append(estimate)
+        self.depth.append(depth)
+        self.parent.append(parent)
+        self.assigned.append(assigned)
+        self.references.append(1)
+        return len(self.value) - 1
+
+    def release(self, node):
+        while node != -1:
+            self.references[node] -= 1
+            if self.references[node]:
+                break
+            self.free.append(node)
+            node = self.parent[node]
+
+    def assignment(self, node, item_count):
+        """
+        Returns the assignment (in the order used by the search) of the items
+        before the depth of node, as an array with item_count elements.
+        """
+        assigned = array('b', [0])*item_count
+        while self.parent[node] != -1:
+            assigned[self.depth[node] - 1] = self.assigned[node]
+            node = self.parent[node]
+        return assigned
+
+    def taken(self, node, items, item_count):
+        """
+        Returns the taken vector of the solution represented by node,
+        following the parent ids up to the root. items are in the order used
+        by the search.
+        """
+        taken = [0]*item_count
+        while self.parent[node] != -1:
+            taken[items[self.depth[node] - 1].index] = self.assigned[node]
+            node = self.parent[node]
+        return taken
+
+    def __len__(self):
+        return len(self.value) - len(self.free)
 
 
 def optimistic_estimate(items, capacity, current_weight=0, current_value=0):
@@ -96,12 +517,566 @@ def optimistic_estimate(items, capacity, current_weight=0, current_value=0):
 
     return value
 
+class DantzigBound(object):
+    """
+    Same estimate as optimistic_estimate (the LP relaxation), but computed in
+    O(log n) without copying the items. It keeps prefix sums of the weights and
+    values of the density sorted items, and finds the critical item (the first
+    one that does not fit) with a binary search over the weights.
+    """
+    def __init__(self, items, capacity):
+        self.items = items
+        self.capacity = capacity
+        self.weights = [0]
+        self.values = [0]
+        for item in items:
+            self.weights.append(self.weights[-1] + item.weight)
+            self.values.append(self.values[-1] + item.value)
+
+    def estimate(self, depth, room, value=0):
+        """
+        Optimistic estimate of a node that already has the given value and room,
+        and can still take the items from depth on.
+        """
+        limit = self.weights[depth] + room
+        critical = bisect_right(self.weights, limit, depth) - 1
+        value += self.values[critical] - self.values[depth]
+        if critical < len(self.items):
+            item = self.items[critical]
+            value += item.value * float(limit - self.weights[critical])/item.weight
+        return value
+
+class MartelloTothBound(DantzigBound):
+    """
+    Martello-Toth upper bound U2. The critical item s is either not taken, and
+    then the room left by the items before it can be filled at most with the
+    density of item s+1, or it is taken, and then room has to be made for it
+    by removing weight from the items before it, losing at least the density
+    of item s-1. The bound is the max of both cases (rounded down, as values
+    are integers), which is never worse than the Dantzig bound. If stats is
+    set (a SearchStats), the estimates tighter than the Dantzig one are
+    counted in stats.bound_tightened.
+    """
+    stats = None
+
+    def estimate(self, depth, room, value=0):
+        limit = self.weights[depth] + room
+        critical = bisect_right(self.weights, limit, depth) - 1
+        value += self.values[critical] - self.values[depth]
+        if critical == len(self.items):
+            return value
+        left = limit - self.weights[critical]
+        item = self.items[critical]
+
+        # Critical item not taken
+        bound = value
+        if critical + 1 < len(self.items):
+            following = self.items[critical + 1]
+            bound += left*following.value//following.weight
+        # Critical item taken (there must be items before it to remove)
+        if critical > depth:
+            previous = self.items[critical - 1]
+            removed = (item.weight - left)*previous.value
+            bound = max(bound, value + item.value - (removed + previous.weight - 1)//previous.weight)
+
+        if self.stats is not None and bound < value + left*item.value//item.weight:
+            self.stats.bound_tightened += 1
+        return bound
+
+class EnumerativeBound(DantzigBound):
+    """
+    Enumerative bound around the critical item: the critical item of the LP
+    relaxation is fixed to 0 and to 1, the LP relaxation of the other items is
+    solved for each case, and so on for levels (ENUMERATED_ITEMS) critical
+    items. The bound is the max of the 2**levels relaxations (rounded down),
+    which is never worse than the Dantzig bound nor U2 (with one level, the
+    two relaxations are the exact values that U2 approximates). Each
+    relaxation skips the fixed items, so it takes O(levels log n). If stats is
+    set, the estimates tighter than the Dantzig one are counted as in
+    MartelloTothBound.
+    """
+    levels = ENUMERATED_ITEMS
+    stats = None
+
+    def relaxation(self, depth, room, value, fixed):
+        """
+        LP relaxation (rounded down) of the items from depth on, except the
+        positions in fixed (a sorted tuple). Returns (bound, critical), with
+        critical None if all the items fit.
+        """
+        start = depth
+        for end in fixed + (len(self.items),):
+            if self.weights[end] - self.weights[start] <= room:
+                room -= self.weights[end] - self.weights[start]
+                value += self.values[end] - self.values[start]
+                start = end + 1
+                continue
+            critical = bisect_right(self.weights, self.weights[start] + room, start) - 1
+            value += self.values[critical] - self.values[start]
+            room -= self.weights[critical] - self.weights[start]
+            item = self.items[critical]
+            return (value + room*item.value//item.weight, critical)
+        return (value, None)
+
+    def enumerate(self, depth, room, value, fixed, levels):
+        bound, critical = self.relaxation(depth, room, value, fixed)
+        if critical is None or levels == 0:
+            return bound
+        item = self.items[critical]
+        fixed = tuple(sorted(fixed + (critical,)))
+        bound = self.enumerate(depth, room, value, fixed, levels - 1)
+        if item.weight <= room:
+            bound = max(bound, self.enumerate(depth, room - item.weight, value + item.value, fixed, levels - 1))
+        return bound
+
+    def estimate(self, depth, room, value=0):
+        bound = self.enumerate(depth, room, value, (), self.levels)
+        if self.stats is not None and bound < self.relaxation(depth, room, value, ())[0]:
+            self.stats.bound_tightened += 1
+        return bound
+
+def critical_item(items, capacity):
+    """
+    Fills the knapsack with the density sorted items in order, and returns
+    (position, weight, value): the position of the first item that does not
+    fit (the critical item, None if all of them fit), and the total weight and
+    value of the items before it.
+    """
+    weight = 0
+    value = 0
+    for position, item in enumerate(items):
+        if weight + item.weight > capacity:
+            return (position, weight, value)
+        weight += item.weight
+        value += item.value
+    return (None, weight, value)
+
+def can_fix(item, critical, scaled_bound, lower):
+    """
+    Dembo and Hammer test. With critical item b of density r, the LP bound
+    with the variable of the item flipped from its LP value is at most
+    U - |v_j - r*w_j|. Returns True if that can not improve lower, so the
+    variable can be fixed. scaled_bound is U*w_b, so only integers are used.
+    """
+    penalty = abs(item.value*critical.weight - critical.value*item.weight)
+    return scaled_bound - penalty < (lower + 1)*critical.weight
+
+def available_memory():
+    """
+    Returns the available memory in bytes, read from /proc/meminfo. If it
+    can not be read, the memory of the biggest compact DP allowed is used.
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except (IOError, OSError, ValueError):
+        pass
+    return MAX_ALLOWED_COMPACT_CELLS//8
+
+def dp_value_row(items, capacity, dtype=None):
+    """
+    Returns the last row of the knapsack DP table for the given items, i.e. a
+    sequence where the k-th element is the best value that fits in capacity k.
+    Uses numpy when available, with the given dtype (by default, int32 unless
+    the total value of the items may overflow it).
+    """
+    if np is not None:
+        if dtype is None:
+            total_value = sum(item.value for item in items)
+            dtype = np.int32 if total_value < 2**31 else np.int64
+        row = np.zeros(capacity + 1, dtype=dtype)
+        for item in items:
+            if item.weight <= capacity:
+                np.maximum(row[item.weight:], row[:capacity + 1 - item.weight] + item.value, out=row[item.weight:])
+        return row
+
+    row = [0]*(capacity + 1)
+    for item in items:
+        weight = item.weight
+        value = item.value
+        for k in xrange(capacity, weight - 1, -1):
+            if row[k - weight] + value > row[k]:
+                row[k] = row[k - weight] + value
+    return row
+
+def hirschberg_knapsack(items, capacity, taken, dtype=None):
+    """
+    Divide and conquer reconstruction of the optimal solution. The items are
+    split in two halves, and the best value row is computed for each one. The
+    capacity c maximizing first[c] + second[capacity - c] is the amount of room
+    used by the first half in an optimal solution, so both halves can be solved
+    independently. Only O(capacity) memory is needed at each level.
+
+    With numpy, the dtype of the rows is chosen once from the total value of
+    all the items, so the sum of the two halves can not overflow it.
+    """
+    if not items:
+        return
+    if np is not None and dtype is None:
+        total_value = sum(item.value for item in items)
+        dtype = np.int32 if total_value < 2**31 else np.int64
+    if len(items) == 1:
+        if items[0].weight <= capacity and items[0].value > 0:
+            taken[items[0].index] = 1
+        return
+
+    middle = len(items)//2
+    first = dp_value_row(items[:middle], capacity, dtype)
+    second = dp_value_row(items[middle:], capacity, dtype)
+    if np is not None:
+        split = int(np.argmax(first + second[::-1]))
+    else:
+        split = 0
+        for c in xrange(capacity + 1):
+            if first[c] + second[capacity - c] > first[split] + second[capacity - split]:
+                split = c
+    del first, second
+
+    hirschberg_knapsack(items[:middle], split, taken, dtype)
+    hirschberg_knapsack(items[middle:], capacity - split, taken, dtype)
+
+def depth_first_dive(items, bound, depth, room, value, assigned, best_value, budget, shared_best=None):
+    """
+    Depth-first branch and bound over the subtree of a node, only keeping the
+    current path (as lazy_depth_first_branch_bound). assigned holds the
+    assignment of the items before depth (in density order), and is used as
+    work space. Each node is counted in budget (and in budget.stats), and
+    the search stops when it expires. If shared_best (a multiprocessing
+    Value) is given, it is read every few nodes for pruning, and updated
+    when the subtree improves it.
+    Returns (value, assigned) of the best solution found that is better than
+    best_value, or (best_value, None) if there is none.
+    """
+    item_count = len(items)
+    values = [value]*(item_count + 1)
+    rooms = [room]*(item_count + 1)
+    stack = Stack()
+    stats = budget.stats
+    estimate = bound.estimate(depth, room, value)
+    found_value = best_value
+    found_assigned = None
+    while True:
+        if budget.expired():
+            break
+        if shared_best is not None and budget.nodes % SearchBudget.CLOCK_CHECK_NODES == 0:
+            best_value = max(best_value, shared_best.value)
+        if depth == item_count:
+            if values[depth] > best_value:
+                best_value = found_value = values[depth]
+                found_assigned = array('b', assigned)
+                if shared_best is not None:
+                    with shared_best.get_lock():
+                        if found_value > shared_best.value:
+                            shared_best.value = found_value
+
+        elif estimate > best_value:
+            stack.push(depth)
+            if len(stack) > stats.max_frontier:
+                stats.max_frontier = len(stack)
+            item = items[depth]
+            if item.weight <= rooms[depth]:
+                assigned[depth] = 1
+                values[depth + 1] = values[depth] + item.value
+                rooms[depth + 1] = rooms[depth] - item.weight
+                depth += 1
+                continue
+            stats.pruned_infeasible += 1
+
+        else:
+            stats.pruned_bound += 1
+
+        found = False
+        while not stack.isEmpty():
+            depth = stack.pop()
+            estimate = bound.estimate(depth + 1, rooms[depth], values[depth])
+            if estimate > best_value:
+                found = True
+                break
+            stats.pruned_bound += 1
+        if not found:
+            break
+        assigned[depth] = 0
+        values[depth + 1] = values[depth]
+        rooms[depth + 1] = rooms[depth]
+        depth += 1
+
+    return (found_value, found_assigned)
+
+# State shared by the worker processes of parallel_branch_bound, set by
+# _init_parallel_worker when the pool is created
+_worker_state = {}
+
+def _init_parallel_worker(items, bound, best_value, deadline):
+    _worker_state['items'] = items
+    _worker_state['bound'] = bound
+    _worker_state['best_value'] = best_value
+    _worker_state['deadline'] = deadline
+
+def _search_subproblem(subproblem):
+    """
+    Depth-first branch and bound over the subtree of a node at a fixed depth,
+    run by the workers of parallel_branch_bound. The best value of all workers
+    is shared through a multiprocessing Value (see depth_first_dive). Returns
+    the best (value, assigned) found in the subtree (assigned is in density
+    order), with assigned None if the subtree could not improve the shared
+    value, whether the search was stopped by the deadline, and the stats of
+    the search.
+    """
+    depth, room, value, prefix = subproblem
+    items = _worker_state['items']
+    shared_best = _worker_state['best_value']
+    deadline = _worker_state['deadline']
+
+    budget = SearchBudget(None if deadline is None else deadline - time.time())
+    assigned = array('b', prefix) + array('b', [0])*(len(items) - depth)
+    found_value, found_assigned = depth_first_dive(
+        items, _worker_state['bound'], depth, room, value, assigned,
+        shared_best.value, budget, shared_best
+    )
+    budget.stats.expanded = budget.nodes
+    return (found_value, found_assigned, budget.stopped, budget.stats)
+
+def _run_portfolio_engine(knapsack, engine, queue, time_limit):
+    """
+    Runs one engine of Knapsack.portfolio_solver in its own process. Messages
+    (kind, engine, value, taken, optimal) are put in the queue: 'incumbent'
+    for each improvement found by the branch and bound engines, and 'done'
+    with the final solution.
+    """
+    def callback(incumbent):
+        queue.put(('incumbent', engine, incumbent.value, incumbent.taken, False))
+
+    optimal = True
+    if engine == 'greedy':
+        taken, value = knapsack.greedy_density()
+        optimal = False
+    elif engine == 'dp':
+        if len(knapsack.items)*knapsack.capacity <= MAX_ALLOWED_COMPACT_CELLS:
+            taken, value = knapsack.dp_solver()
+        else:
+            taken, value = knapsack.dynamic_programming_hirschberg()
+    elif engine == 'core':
+        taken, value = knapsack.core_solver(time_limit=time_limit)
+        optimal = knapsack.incumbent.optimal
+    else:
+        method = PORTFOLIO_ENGINES[engine]
+        taken, value = getattr(knapsack, method)(time_limit=time_limit, callback=callback)
+        optimal = knapsack.incumbent.optimal
+    queue.put(('done', engine, value, taken, optimal))
+
+class Reduction(object):
+    """
+    Result of Knapsack.reduce. knapsack is the core problem (with its items
+    indexed from 0), mapping[i] is the original index of the core item i, and
+    fixed holds the original indices of the items that are known to be taken.
+    incumbent is the (taken, value) solution used for the reduction, which is
+    returned by restore if the core solution is not better.
+    """
+    def __init__(self, knapsack, mapping, fixed, item_count, incumbent):
+        self.knapsack = knapsack
+        self.mapping = mapping
+        self.fixed = fixed
+        self.item_count = item_count
+        self.incumbent = incumbent
+
+    def restore(self, taken, value):
+        """
+        Maps a (taken, value) solution of the core problem back to the original
+        items.
+        """
+        full_taken = [0]*self.item_count
+        for item in self.fixed:
+            full_taken[item.index] = 1
+            value += item.value
+        for core_index, index in enumerate(self.mapping):
+            full_taken[index] = taken[core_index]
+        if value < self.incumbent[1]:
+            return self.incumbent
+        return (full_taken, value)
+
 class Knapsack(object):
-    def __init__(self, items, item_count, capacity):
-        self.items      = list(items)
+    def __init__(self, items, item_count, capacity, dp_backend=None, bound=DantzigBound,
+                 log_interval=None, profile=False):
+        # ItemColumns are kept as they are, so their items are only built
+        # when a solver needs them
+        self.items      = items if isinstance(items, ItemColumns) else list(items)
         self.item_count = item_count
         self.capacity   = capacity
+        # One of the DP_BACKENDS keys, None means the fastest one available
+        self.dp_backend = dp_backend
+        # Class built from the density sorted items and the capacity, used
+        # for the optimistic estimates of the nodes
+        self.bound      = bound
+        # Final Incumbent of the last branch and bound search
+        self.incumbent  = None
+        # Engine chosen by the last hybrid_solver call (with its predicted
+        # time), or the one that won the last portfolio_solver race
+        self.selection  = None
+        # SearchStats of the last engine run. If log_interval is given, the
+        # searches log their stats every log_interval seconds, and if profile
+        # is set, the time spent in the bound is measured (see TimedBound)
+        self.stats        = None
+        self.log_interval = log_interval
+        # Built by the first density_sorted_items call
+        self.sorted_items = None
+        self.profile      = profile
 
+    @classmethod
+    def from_arrays(cls, values, weights, capacity, **kwargs):
+        """
+        Builds a Knapsack from the columns of values and weights (any sequence
+        of integers), the item indexes being their positions.
+        """
+        items = ItemColumns(array('l', values), array('l', weights))
+        return cls(items, len(items), capacity, **kwargs)
+
+    @classmethod
+    def from_file(cls, file_location, **kwargs):
+        """
+        Builds a Knapsack from an instance file, using read_instance.
+        """
+        item_count, capacity, items = read_instance(file_location)
+        return cls(items, item_count, capacity, **kwargs)
+
+    def search_stats(self):
+        """
+        Builds the SearchStats of a new search, and keeps it in self.stats.
+        """
+        self.stats = SearchStats(self.log_interval)
+        return self.stats
+
+    def search_capacity(self):
+        """
+        Capacity used by the branch and bound searches. No solution weighs
+        more than max_reachable_weight, so it is used instead of the capacity
+        (which tightens the bounds) when it is cheap to compute.
+        """
+        if len(self.items)*(self.capacity + 1) < REACHABLE_WEIGHT_CELLS:
+            return self.max_reachable_weight()
+        return self.capacity
+
+    def search_bound(self, items, stats, bound=None, capacity=None):
+        """
+        Builds the bound of the density sorted items (of the given class, or
+        self.bound), wrapped by a TimedBound if profiling.
+        """
+        bound = (bound or self.bound)(items, self.capacity if capacity is None else capacity)
+        bound.stats = stats
+        if self.profile:
+            bound = TimedBound(bound, stats)
+        return bound
+
+    def density_sorted_items(self):
+        """
+        Returns the items sorted by value density (value/weight), from the
+        most to the least dense, as used by the optimistic estimate. The list
+        is built once and shared by all the engines (e.g. estimate_costs and
+        the engine chosen by hybrid_solver), so it must not be modified.
+        """
+        if self.sorted_items is not None:
+            return self.sorted_items
+        if isinstance(self.items, ItemColumns):
+            # Straight from the columns, without building the Item tuples
+            columns = izip(xrange(len(self.items)), self.items.values, self.items.weights)
+        else:
+            columns = ((item.index, item.value, item.weight) for item in self.items)
+        items = [
+            DensityItem(index, value/float(weight), weight, value)
+            for index, value, weight in columns
+        ]
+        self.sorted_items = sorted(items, key=attrgetter('density'), reverse=True)
+        return self.sorted_items
+
+    def reduce(self):
+        """
+        Builds a smaller core problem, before running any solver. It removes
+        the items heavier than the capacity, the dominated items, and fixes
+        the variables whose value is decided by the LP bound:
+
+        - An item j is dominated by i if w_i <= w_j and v_i >= v_j. If all the
+          items dominating j and j itself do not fit together, some of them is
+          always out of the knapsack, and j can be swapped by it, so j can be
+          removed. Ties are broken by a fixed order, and the sums are computed
+          with a Fenwick tree over the values, in O(n log n).
+        - Using the critical item (the first one that does not fit in density
+          order), the variables that can not be flipped from their LP value to
+          improve the greedy solution are fixed (see can_fix).
+
+        Returns a Reduction, any solver can be run on its knapsack, and the
+        solution mapped back with Reduction.restore.
+        """
+        incumbent = self.greedy_local_search()
+        lower = incumbent[1]
+        capacity = self.capacity
+        fixed = []
+        candidates = []
+        for item in self.items:
+            if item.weight > capacity:
+                continue
+            if item.weight == 0:
+                fixed.append(item)
+            else:
+                candidates.append(item)
+
+        # Dominated items
+        ranks = dict((value, rank) for rank, value in enumerate(
+            sorted(set(item.value for item in candidates), reverse=True), 1))
+        tree = [0]*(len(ranks) + 1)
+        kept = []
+        for item in sorted(candidates, key=lambda item: (item.weight, -item.value, item.index)):
+            rank = ranks[item.value]
+            dominating_weight = 0
+            i = rank
+            while i > 0:
+                dominating_weight += tree[i]
+                i -= i & -i
+            if dominating_weight + item.weight <= capacity:
+                kept.append(item)
+            i = rank
+            while i < len(tree):
+                tree[i] += item.weight
+                i += i & -i
+
+        # Variable fixing with the critical item
+        items = sorted(kept, key=lambda item: item.value/float(item.weight), reverse=True)
+        position, weight, value = critical_item(items, capacity)
+
+        core = []
+        if position is None:
+            fixed.extend(items)
+        else:
+            critical = items[position]
+            scaled_bound = value*critical.weight + critical.value*(capacity - weight)
+            for i, item in enumerate(items):
+                if i == position or not can_fix(item, critical, scaled_bound, lower):
+                    core.append(item)
+                elif i < position:
+                    fixed.append(item)
+                    capacity -= item.weight
+
+        core_items = []
+        mapping = []
+        for item in core:
+            if item.weight <= capacity:
+                core_items.append(Item(len(core_items), item.value, item.weight))
+                mapping.append(item.index)
+        knapsack = Knapsack(core_items, len(core_items), capacity, self.dp_backend, self.bound,
+                            self.log_interval, self.profile)
+        return Reduction(knapsack, mapping, fixed, len(self.items), incumbent)
+
+    def solve_reduced(self, method='hybrid_solver', *args, **kwargs):
+        """
+        Runs the given solver method on the reduced problem, and returns the
+        solution for the original items.
+        """
+        reduction = self.reduce()
+        taken, value = getattr(reduction.knapsack, method)(*args, **kwargs)
+        self.stats = reduction.knapsack.stats
+        return reduction.restore(taken, value)
+
+    @recorded
     def trivial_greedy(self):
         """
         This is the approach that was in the initial code.
@@ -120,6 +1095,7 @@ class Knapsack(object):
 
         return (taken, value)
 
+    @recorded
     def greedy_more_items(self):
         """
         This approach, uses the first greedy idea from the lecture. Takes
@@ -135,6 +1111,7 @@ class Knapsack(object):
                 weight += item.weight
         return (taken, value)
 
+    @recorded
     def greedy_most_valuable(self):
         """
         This approach, uses the second greedy idea from the lecture. Prefers
@@ -150,6 +1127,7 @@ class Knapsack(object):
                 weight += item.weight
         return (taken, value)
 
+    @recorded
     def greedy_density(self):
         """
         This approach, uses the second greedy idea from the lecture. Prefers
@@ -175,6 +1153,96 @@ class Knapsack(object):
                 weight += item.weight
         return (taken, value)
 
+    @recorded
+    def greedy_local_search(self, window=CORE_SIZE):
+        """
+        Starts from the density greedy solution, and improves it with a local
+        search, applying the best improving move until there is none:
+
+        - 1-swaps: adding an untaken item that fits in the slack, or exchanging
+          a taken item by an untaken one. The best exchange for each taken item
+          is found with a binary search over the untaken items sorted by
+          weight (with the prefix max of their values), so a pass is
+          O(n log n).
+        - 2-swaps: exchanging one taken item by two untaken ones, or two taken
+          items by one untaken, among the window items at each side of the
+          critical item, which is where the greedy solution is usually wrong.
+
+        The slack (room left) is updated with each move. The result is used as
+        the starting incumbent of the branch and bound methods.
+        """
+        items = self.density_sorted_items()
+        taken = array('b', [0])*len(items)
+        value = 0
+        slack = self.capacity
+        critical = len(items)
+        for p, item in enumerate(items):
+            if item.weight <= slack:
+                taken[p] = 1
+                value += item.value
+                slack -= item.weight
+            elif critical == len(items):
+                critical = p
+        window = range(max(0, critical - window), min(len(items), critical + window + 1))
+
+        while True:
+            # 1-swaps, (gain, removed, added) of the best one
+            untaken = sorted((item.weight, p) for p, item in enumerate(items) if not taken[p])
+            weights = [weight for weight, _ in untaken]
+            best_untaken = []
+            for _, p in untaken:
+                if not best_untaken or items[p].value > items[best_untaken[-1]].value:
+                    best_untaken.append(p)
+                else:
+                    best_untaken.append(best_untaken[-1])
+            best = (0, (), ())
+            for p in [None] + [p for p in xrange(len(items)) if taken[p]]:
+                weight, item_value = (0, 0) if p is None else (items[p].weight, items[p].value)
+                fits = bisect_right(weights, slack + weight)
+                if fits:
+                    q = best_untaken[fits - 1]
+                    gain = items[q].value - item_value
+                    if gain > best[0]:
+                        best = (gain, () if p is None else (p,), (q,))
+
+            # 2-swaps in the window
+            if best[0] == 0:
+                inside = [p for p in window if taken[p]]
+                outside = [p for p in window if not taken[p]]
+                for i, p in enumerate(outside):
+                    for q in outside[i + 1:]:
+                        weight = items[p].weight + items[q].weight
+                        item_value = items[p].value + items[q].value
+                        for r in inside:
+                            if (weight - items[r].weight <= slack
+                                    and item_value - items[r].value > best[0]):
+                                best = (item_value - items[r].value, (r,), (p, q))
+                for i, p in enumerate(inside):
+                    for q in inside[i + 1:]:
+                        weight = items[p].weight + items[q].weight
+                        item_value = items[p].value + items[q].value
+                        for r in outside:
+                            if (items[r].weight - weight <= slack
+                                    and items[r].value - item_value > best[0]):
+                                best = (items[r].value - item_value, (p, q), (r,))
+
+            gain, removed, added = best
+            if gain == 0:
+                break
+            for p in removed:
+                taken[p] = 0
+                slack += items[p].weight
+            for p in added:
+                taken[p] = 1
+                slack -= items[p].weight
+            value += gain
+
+        solution = [0]*len(self.items)
+        for p, item in enumerate(items):
+            solution[item.index] = taken[p]
+        return (solution, value)
+
+    @recorded
     def dynamic_programming(self):
         """
         This implements the dynamic programming approach. Basically implements
@@ -186,14 +1254,14 @@ class Knapsack(object):
             for k in xrange(self.capacity + 1)
         ]
 
-        for j in xrange(self.item_count + 1):
+        for j in xrange(1, self.item_count + 1):
+            # Looked up once per item, as ItemColumns builds an Item each time
+            item = self.items[j-1]
             for k in xrange(self.capacity + 1):
-                if j == 0:
-                    continue
-                if self.items[j-1].weight <= k:
+                if item.weight <= k:
                     dp_table[k][j] = max(
                         dp_table[k][j - 1],
-                        self.items[j-1].value + dp_table[k - self.items[j-1].weight][j - 1]
+                        item.value + dp_table[k - item.weight][j - 1]
                     )
                 else:
                     dp_table[k][j] = dp_table[k][j - 1]
@@ -203,147 +1271,933 @@ class Knapsack(object):
         k = self.capacity
         for j in xrange(self.item_count, 0, -1):
             if dp_table[k][j] != dp_table[k][j-1]:
-                taken[j-1] = 1
-                traceback_value = dp_table[k][j] - self.items[j-1].value
-                while traceback_value != dp_table[k][j-1] and k > 0:
-                    k -= 1
+                taken[self.items[j-1].index] = 1
+                k -= self.items[j-1].weight
+        return (taken, value)
+
+    @recorded
+    def dynamic_programming_compact(self):
+        """
+        Same recurrence as dynamic_programming, but only keeps a single row of
+        values (indexed by capacity), which is updated in place from right to left
+        for each item. For recovering the solution, a take-matrix is stored with
+        one bit per (item, capacity) cell, packed in a bytearray per item, so the
+        memory used is about item_count*capacity/8 bytes instead of a full table
+        of Python integers.
+        """
+        row = [0]*(self.capacity + 1)
+        take = []
+        for item in self.items:
+            weight = item.weight
+            value = item.value
+            bits = bytearray((self.capacity >> 3) + 1)
+            for k in xrange(self.capacity, weight - 1, -1):
+                candidate = row[k - weight] + value
+                if candidate > row[k]:
+                    row[k] = candidate
+                    bits[k >> 3] |= 1 << (k & 7)
+            take.append(bits)
+
+        value = row[self.capacity]
+        taken = [0]*len(self.items)
+        k = self.capacity
+        for j in xrange(len(self.items) - 1, -1, -1):
+            if (take[j][k >> 3] >> (k & 7)) & 1:
+                taken[self.items[j].index] = 1
+                k -= self.items[j].weight
+        return (taken, value)
+
+    @recorded
+    def dynamic_programming_numpy(self):
+        """
+        Vectorized version of dynamic_programming_compact. Each item is processed
+        as a whole-array operation: the row shifted by the item weight plus the
+        item value is compared against the row, and the maximum is kept. The
+        comparison mask is stored with np.packbits (one bit per cell) for the
+        traceback. The dtype is int32 unless the total value may overflow it.
+        If numpy is not available, it falls back to the pure Python version.
+        """
+        if np is None:
+            return self.dynamic_programming_compact()
+
+        total_value = sum(item.value for item in self.items)
+        dtype = np.int32 if total_value < 2**31 else np.int64
+        row = np.zeros(self.capacity + 1, dtype=dtype)
+        take = []
+        for item in self.items:
+            weight = item.weight
+            if weight > self.capacity:
+                take.append(None)
+                continue
+            candidate = row[:self.capacity + 1 - weight] + item.value
+            better = candidate > row[weight:]
+            np.maximum(row[weight:], candidate, out=row[weight:])
+            take.append(np.packbits(better))
+
+        value = int(row[self.capacity])
+        taken = [0]*len(self.items)
+        k = self.capacity
+        for j in xrange(len(self.items) - 1, -1, -1):
+            weight = self.items[j].weight
+            if take[j] is None or k < weight:
+                continue
+            # packbits stores the first cell in the most significant bit
+            cell = k - weight
+            if (take[j][cell >> 3] >> (7 - (cell & 7))) & 1:
+                taken[self.items[j].index] = 1
+                k = cell
+        return (taken, value)
+
+    @recorded
+    def dynamic_programming_hirschberg(self):
+        """
+        Exact DP using O(capacity) memory. The value is taken from a single row,
+        and the items taken are recovered by the divide and conquer approach
+        of hirschberg_knapsack, instead of storing a take-matrix.
+        """
+        taken = [0]*len(self.items)
+        hirschberg_knapsack(self.items, self.capacity, taken)
+        value = sum(item.value for item in self.items if taken[item.index])
         return (taken, value)
 
-    def depth_first_branch_bound(self):
+    @recorded
+    def dynamic_programming_sparse(self):
+        """
+        DP over the list of non-dominated (weight, value) states instead of a
+        dense row indexed by capacity. For each item (in density order), the
+        states shifted by the item are merged with the current ones, keeping
+        only states whose value is strictly bigger than any lighter state. A
+        state is also dropped when its optimistic estimate over the remaining
+        items can not improve the best value known. The taken items of each
+        state are kept as a linked list of (index, parent) tuples, which are
+        shared between states.
+
+        On subset-sum instances every state is non-dominated and the LP bound
+        never prunes (all the items have the same density), so they are solved
+        by subset_sum_bitset instead.
+        """
+        if self.is_subset_sum():
+            return self.subset_sum_bitset()
+        items = self.density_sorted_items()
+        bound = self.bound(items, self.capacity)
+
+        greedy_taken, best_value = self.greedy_density()
+        best_state = None
+        states = [(0, 0, None)]
+        for j, item in enumerate(items):
+            shifted = [
+                (weight + item.weight, value + item.value, (item.index, chain))
+                for (weight, value, chain) in states
+                if weight + item.weight <= self.capacity
+            ]
+
+            merged = []
+            a = b = 0
+            while a < len(states) or b < len(shifted):
+                if b == len(shifted) or (a < len(states) and (
+                        states[a][0] < shifted[b][0] or
+                        (states[a][0] == shifted[b][0] and states[a][1] >= shifted[b][1]))):
+                    state = states[a]
+                    a += 1
+                else:
+                    state = shifted[b]
+                    b += 1
+                if merged and state[1] <= merged[-1][1]:
+                    continue
+                if bound.estimate(j + 1, self.capacity - state[0], state[1]) <= best_value:
+                    continue
+                merged.append(state)
+            states = merged
+
+            if states and states[-1][1] > best_value:
+                best_value = states[-1][1]
+                best_state = states[-1]
+
+        if best_state is None:
+            return (greedy_taken, best_value)
+
+        taken = [0]*len(self.items)
+        chain = best_state[2]
+        while chain is not None:
+            taken[chain[0]] = 1
+            chain = chain[1]
+        return (taken, best_value)
+
+    @recorded
+    def dynamic_programming_by_value(self, epsilon=None):
+        """
+        DP indexed by value instead of capacity: row[v] is the minimum weight
+        needed to reach a value of exactly v, and the best solution is the
+        biggest v with row[v] <= capacity. Its size depends on the total value,
+        not on the capacity. The take-matrix is bit-packed as in
+        dynamic_programming_compact.
+
+        If epsilon is given, values are scaled down by K = epsilon*vmax/n (and
+        rounded down) before running the DP, which gives a solution with value
+        at least (1 - epsilon) times the optimal one, in O(n^3/epsilon) time
+        (FPTAS). The returned value is the one of the original items.
+        """
+        items = [item for item in self.items if item.weight <= self.capacity]
+        scale = 1
+        if epsilon is not None and items:
+            scale = max(1, int(epsilon*max(item.value for item in items)/len(items)))
+        values = [item.value//scale for item in items]
+
+        total_value = sum(values)
+        infinity = self.capacity + 1
+        row = [0] + [infinity]*total_value
+        take = []
+        reached = 0
+        for item, value in zip(items, values):
+            weight = item.weight
+            bits = bytearray((total_value >> 3) + 1)
+            reached += value
+            for v in xrange(reached, value - 1, -1):
+                candidate = row[v - value] + weight
+                if candidate < row[v]:
+                    row[v] = candidate
+                    bits[v >> 3] |= 1 << (v & 7)
+            take.append(bits)
+
+        v = total_value
+        while row[v] > self.capacity:
+            v -= 1
+        taken = [0]*len(self.items)
+        for j in xrange(len(items) - 1, -1, -1):
+            if (take[j][v >> 3] >> (v & 7)) & 1:
+                taken[items[j].index] = 1
+                v -= values[j]
+        value = sum(item.value for item in self.items if taken[item.index])
+        return (taken, value)
+
+    def reachable_weights(self):
+        """
+        Returns the set of total weights that can be reached by some subset of
+        the items (up to the capacity), as a Python integer whose k-th bit is
+        set if the weight k can be reached. Adding an item is a single shift
+        and or, so each word of 64 weights is processed at once.
+        """
+        mask = (1 << (self.capacity + 1)) - 1
+        reach = 1
+        for item in self.items:
+            reach |= (reach << item.weight) & mask
+        return reach
+
+    def max_reachable_weight(self):
+        """
+        The biggest total weight that fits in the knapsack. The capacity can be
+        replaced by it in any bound, which tightens the LP bound when no subset
+        of the items fills the knapsack (see search_capacity).
+        """
+        return self.reachable_weights().bit_length() - 1
+
+    def is_subset_sum(self):
+        """
+        True if the value of every item is proportional to its weight, so the
+        best solution is the heaviest subset that fits.
+        """
+        items = iter(self.items)
+        first = next(items, None)
+        if first is None:
+            return True
+        return all(item.value*first.weight == first.value*item.weight for item in items)
+
+    @recorded
+    def subset_sum_bitset(self):
+        """
+        Bitset DP for subset-sum instances (value equal to weight for every
+        item, or proportional to it), where the best solution is the subset
+        with the biggest total weight that fits. The reachable set after each
+        item is kept for the traceback (one bit per item and weight, as
+        dynamic_programming_compact). For other instances the solution is
+        feasible but not optimal.
+        """
+        mask = (1 << (self.capacity + 1)) - 1
+        reach = 1
+        snapshots = []
+        for item in self.items:
+            snapshots.append(reach)
+            reach |= (reach << item.weight) & mask
+
+        k = reach.bit_length() - 1
+        taken = [0]*len(self.items)
+        for j in xrange(len(self.items) - 1, -1, -1):
+            if not (snapshots[j] >> k) & 1:
+                taken[self.items[j].index] = 1
+                k -= self.items[j].weight
+        value = sum(item.value for item in self.items if taken[item.index])
+        return (taken, value)
+
+    @recorded
+    def dynamic_programming_bitset(self):
+        """
+        Value-bucketed bitset DP. For each value v reachable by a subset of the
+        items, it keeps the set of weights (up to the capacity) of the subsets
+        with exactly that value as a Python integer, so adding an item to a
+        bucket is a shift and an or over the whole weight dimension. The best
+        solution is the biggest value with a non empty set. Dominated weights
+        are dropped after each item. The buckets after each item are kept for
+        the traceback, so it is meant for instances with small total value.
+        """
+        mask = (1 << (self.capacity + 1)) - 1
+        buckets = {0: 1}
+        snapshots = []
+        for item in self.items:
+            snapshots.append(buckets)
+            updated = dict(buckets)
+            for value, weights in buckets.iteritems():
+                shifted = (weights << item.weight) & mask
+                if shifted:
+                    updated[value + item.value] = updated.get(value + item.value, 0) | shifted
+            # A weight is dominated if a bigger value is reached with a lighter
+            # (or equal) weight, so each bucket only keeps the weights below the
+            # lightest one of the bigger values
+            lightest = None
+            for value in sorted(updated, reverse=True):
+                weights = updated[value]
+                if lightest is not None:
+                    weights &= (1 << lightest) - 1
+                    if not weights:
+                        del updated[value]
+                        continue
+                    updated[value] = weights
+                lightest = (weights & -weights).bit_length() - 1
+            buckets = updated
+
+        value = max(buckets)
+        best_value = value
+        weights = buckets[value]
+        # Lowest weight with the best value
+        k = (weights & -weights).bit_length() - 1
+        taken = [0]*len(self.items)
+        for j in xrange(len(self.items) - 1, -1, -1):
+            if not (snapshots[j].get(value, 0) >> k) & 1:
+                taken[self.items[j].index] = 1
+                value -= self.items[j].value
+                k -= self.items[j].weight
+        return (taken, best_value)
+
+    @recorded
+    def dp_solver(self):
+        """
+        Runs the DP backend selected when building the Knapsack. By default
+        it uses the vectorized version when numpy is installed, and the compact
+        one otherwise. The 'subset_sum' backend is only exact on subset-sum
+        instances, so the default is used for the other ones.
+        """
+        backend = self.dp_backend
+        if backend == 'subset_sum' and not self.is_subset_sum():
+            backend = None
+        if backend is None:
+            backend = 'numpy' if np is not None else 'compact'
+        return getattr(self, DP_BACKENDS[backend])()
+
+    def estimate_costs(self):
+        """
+        Cost model used by hybrid_solver. Returns a dict with the predicted time
+        in seconds of each engine whose memory fits in the available memory:
+
+        - DP backends: item_count*(capacity + 1) cells, at the speed in
+          ENGINE_SPEED, and the memory of their take-matrix and rows. The DP
+          by value has item_count*(total value + 1) cells instead. On
+          subset-sum instances (see is_subset_sum), subset_sum_bitset is
+          considered too. The sparse and bitset DPs are not: their number of
+          states depends on how the values are spread, and their worst case
+          never wins.
+        - core: flipping an item from its LP value decreases the LP bound by
+          a penalty that grows with the distance between its density and the
+          critical one (see can_fix). Only combinations of flips whose total
+          penalty is less than the gap between the root LP bound and the
+          greedy solution may improve it. Their number is counted with a DP
+          over the gap split in PENALTY_BUCKETS buckets (rounding down the
+          penalties, so it overestimates, and clamping it to
+          BB_MAX_COMBINATIONS), and the tree is expected to have about
+          item_count + combinations**BB_EXPONENT nodes.
+
+        If dp_backend was given (and it is not sparse or bitset, or subset_sum
+        on an instance that is not subset-sum), it is the only DP backend
+        considered.
+        """
+        # The density sorted items are used for everything, as they are built
+        # once (and kept for the engine run by hybrid_solver)
+        items = self.density_sorted_items()
+        item_count = len(items)
+        row = self.capacity + 1
+        cells = item_count*row
+        total_value = sum(item.value for item in items)
+        memory = available_memory()
+        dp_memory = {
+            'table': 32*cells,
+            'compact': cells//8 + 40*row,
+            'numpy': cells//8 + 32*row,
+            'hirschberg': 64*row,
+            'value': item_count*(total_value + 1)//8 + 40*(total_value + 1),
+            'subset_sum': cells//8,
+        }
+        dp_cells = {
+            'table': cells,
+            'compact': cells,
+            'numpy': cells,
+            'hirschberg': 2*cells,
+            'value': item_count*(total_value + 1),
+            'subset_sum': cells,
+        }
+        subset_sum = self.is_subset_sum()
+        if self.dp_backend in dp_cells and (self.dp_backend != 'subset_sum' or subset_sum):
+            backends = [self.dp_backend]
+        else:
+            backends = ['compact', 'hirschberg', 'value']
+            if np is not None:
+                backends.append('numpy')
+            if subset_sum:
+                backends.append('subset_sum')
+
+        costs = {}
+        for backend in backends:
+            if dp_memory[backend] <= memory:
+                speed = ENGINE_SPEED[backend]
+                if backend == 'hirschberg' and np is not None:
+                    speed = ENGINE_SPEED['numpy']
+                costs[backend] = dp_cells[backend]/float(speed)
+
+        position, weight, value = critical_item(items, self.capacity)
+        combinations = 1.0
+        if position is not None:
+            # Value of greedy_density, which takes the items in this order
+            greedy_value = 0
+            room = self.capacity
+            for item in items:
+                if item.weight <= room:
+                    greedy_value += item.value
+                    room -= item.weight
+            critical = items[position]
+            scaled_bound = value*critical.weight + critical.value*(self.capacity - weight)
+            gap = scaled_bound - greedy_value*critical.weight
+            count = [1.0] + [0.0]*(PENALTY_BUCKETS - 1)
+            for item in items:
+                penalty = abs(item.value*critical.weight - critical.value*item.weight)
+                if penalty >= gap:
+                    continue
+                size = penalty*PENALTY_BUCKETS//gap
+                for bucket in xrange(PENALTY_BUCKETS - 1 - size, -1, -1):
+                    count[bucket + size] += count[bucket]
+            combinations = min(sum(count), BB_MAX_COMBINATIONS)
+        nodes = item_count + combinations**BB_EXPONENT
+        costs['core'] = nodes/ENGINE_SPEED['core']
+        return costs
+
+    def depth_first_branch_bound(self, time_limit=None, node_limit=None, callback=None, bound=None):
         """
         This implements depth-first branch and bound, using the optimistic estimate
         with relaxation (as the lecture). I should try improving this function by
         allowing specifying the estimate I want to use. For now, I am using the
-        relaxation of allowing xi to be a real number
+        relaxation of allowing xi to be a real number, with the capacity given
+        by search_capacity. Nodes are stored in a NodePool, and the stack only
+        holds node ids. A node is released once its children are pushed, and
+        the assignment of the current path is kept by depth (the last node
+        popped at each depth is an ancestor of the next one), so memory follows
+        the frontier and not the number of nodes generated. The estimate can
+        now be chosen with bound (a class as DantzigBound, MartelloTothBound or
+        EnumerativeBound), which overrides the one given to the constructor.
+
+        The search starts from the greedy_local_search solution, and can be
+        stopped by a time_limit (seconds) or node_limit, returning the best
+        solution found so far. callback is called with an Incumbent each time
+        the best solution improves, and the final Incumbent is kept in
+        self.incumbent.
         """
         # Relaxation and optimal estimation
-        Item = namedtuple("Item", ['index', 'density', 'weight', 'value'])
-        items = []
-        for item in self.items:
-            items.append(
-                Item(
-                    item.index,
-                    item.value/float(item.weight),
-                    item.weight,
-                    item.value
-                )
-            )
-        items = sorted(items, key=attrgetter('density'), reverse=True)
+        items = self.density_sorted_items()
+        best_taken, best_solution_value = self.greedy_local_search()
+        stats = self.search_stats()
+        capacity = self.search_capacity()
+        bound = self.search_bound(items, stats, bound, capacity)
+        budget = SearchBudget(time_limit, node_limit, callback, stats)
 
+        item_count = len(items)
+        assigned = array('b', [0])*item_count
+        pool = NodePool()
         stack = Stack()
-        root = KnapsackNode(0, self.capacity, optimistic_estimate(items, self.capacity))
+        root = pool.add(0, capacity, bound.estimate(0, capacity))
         stack.push(root)
-        best_solution_value = 0
-        solution_node = None
-        #n = 0
+        root_bound = pool.estimate[root]
+        budget.improved(best_solution_value, best_taken, root_bound)
         while not stack.isEmpty():
+            if budget.expired():
+                break
             node = stack.pop()
-            #n += 1
-            # Prunning the search tree if I found a non good estimate
-            #if node.item_id != self.item_count - 1:
-                #if solution_node is not None and node.estimate < best_solution_value:
-                #    continue
-            #print node, best_solution_value
-            #raw_input()
-            if node.depth == self.item_count:
-                if node.value > best_solution_value:
-                    best_solution_value = node.value
-                    solution_node = node
-
-            elif node.estimate > best_solution_value:
-                item = items[node.depth]
-                neighbors = node.expand(
-                    item.value,
-                    item.weight,
-                    optimistic_estimate(items[node.depth+1:], self.capacity, self.capacity - node.room, node.value),
-                    items[node.depth].index
-                )
-                for neighbor in reversed(neighbors):
-                    if neighbor.room >= 0 and neighbor.estimate > best_solution_value:
-                        stack.push(neighbor)
-                        #if neighbor.assigned == 1 and neighbor.value > best_solution_value:
-                        #    best_solution_value = neighbor.value
-            #else:
-            #    if node.value > best_solution_value:
-            #        best_solution_value = node.estimate
-            #        solution_node = node
-        #print "nodes expanded: ", n
-        value = solution_node.value
-        taken = [0]*len(self.items)
-        while solution_node.parent is not None:
-            taken[solution_node.index] = solution_node.assigned
-            solution_node = solution_node.parent
-        return (taken, value)
+            depth = pool.depth[node]
+            value = pool.value[node]
+            if depth:
+                assigned[depth - 1] = pool.assigned[node]
+            if depth == item_count:
+                if value > best_solution_value:
+                    best_solution_value = value
+                    best_taken = [0]*len(self.items)
+                    for item, x in zip(items, assigned):
+                        best_taken[item.index] = x
+                    budget.improved(value, best_taken, root_bound)
+
+            elif pool.estimate[node] > best_solution_value:
+                item = items[depth]
+                room = pool.room[node]
+                # The right child (item not taken) is pushed first, so the
+                # left one is explored first
+                right_estimate = bound.estimate(depth + 1, room, value)
+                if right_estimate > best_solution_value:
+                    stack.push(pool.add(value, room, right_estimate, node, depth + 1, 0))
+                else:
+                    stats.pruned_bound += 1
+                if item.weight <= room:
+                    stack.push(pool.add(value + item.value, room - item.weight, pool.estimate[node], node, depth + 1, 1))
+                else:
+                    stats.pruned_infeasible += 1
+                if len(stack) > stats.max_frontier:
+                    stats.max_frontier = len(stack)
 
-    def best_first_branch_bound(self):
+            else:
+                stats.pruned_bound += 1
+            pool.release(node)
+
+        frontier = [pool.estimate[node] for node in stack.stack]
+        self.incumbent = budget.finish(best_solution_value, best_taken, root_bound, frontier)
+        return (best_taken, best_solution_value)
+
+    def lazy_depth_first_branch_bound(self, time_limit=None, node_limit=None, callback=None, bound=None):
+        """
+        Depth-first branch and bound that only keeps the current path. It dives
+        taking items while the estimate is better than the best solution found,
+        and the stack only holds the depths whose right child (item not taken)
+        is pending. The right child is built when backtracking to it, so its
+        estimate is computed against the best solution known at that point, and
+        it is not built at all if it can not improve it. Memory is O(n).
+        Budget, callback and bound work as in depth_first_branch_bound.
+        """
+        items = self.density_sorted_items()
+        best_taken, best_solution_value = self.greedy_local_search()
+        stats = self.search_stats()
+        capacity = self.search_capacity()
+        bound = self.search_bound(items, stats, bound, capacity)
+        budget = SearchBudget(time_limit, node_limit, callback, stats)
+
+        item_count = len(items)
+        assigned = array('b', [0])*item_count
+        values = [0]*(item_count + 1)
+        rooms = [capacity]*(item_count + 1)
+        stack = Stack()
+        depth = 0
+        estimate = bound.estimate(0, capacity)
+        root_bound = estimate
+        budget.improved(best_solution_value, best_taken, root_bound)
+        while True:
+            if budget.expired():
+                break
+            if depth == item_count:
+                if values[depth] > best_solution_value:
+                    best_solution_value = values[depth]
+                    best_taken = [0]*len(self.items)
+                    for item, x in zip(items, assigned):
+                        best_taken[item.index] = x
+                    budget.improved(best_solution_value, best_taken, root_bound)
+
+            elif estimate > best_solution_value:
+                # The left child keeps the estimate of its parent
+                stack.push(depth)
+                if len(stack) > stats.max_frontier:
+                    stats.max_frontier = len(stack)
+                item = items[depth]
+                if item.weight <= rooms[depth]:
+                    assigned[depth] = 1
+                    values[depth + 1] = values[depth] + item.value
+                    rooms[depth + 1] = rooms[depth] - item.weight
+                    depth += 1
+                    continue
+                stats.pruned_infeasible += 1
+
+            else:
+                stats.pruned_bound += 1
+
+            # Backtrack to the deepest pending right child worth exploring
+            found = False
+            while not stack.isEmpty():
+                depth = stack.pop()
+                estimate = bound.estimate(depth + 1, rooms[depth], values[depth])
+                if estimate > best_solution_value:
+                    found = True
+                    break
+                stats.pruned_bound += 1
+            if not found:
+                break
+            assigned[depth] = 0
+            values[depth + 1] = values[depth]
+            rooms[depth + 1] = rooms[depth]
+            depth += 1
+
+        frontier = []
+        if budget.stopped:
+            frontier.append(estimate)
+            for pending in stack.stack:
+                frontier.append(bound.estimate(pending + 1, rooms[pending], values[pending]))
+        self.incumbent = budget.finish(best_solution_value, best_taken, root_bound, frontier)
+        return (best_taken, best_solution_value)
+
+    def best_first_branch_bound(self, time_limit=None, node_limit=None, callback=None, max_frontier=None, bound=None):
         """
         This implements best-first branch and bound, using the optimistic estimate
         with relaxation (as the lecture). I should try improving this function by
         allowing specifying the estimate I want to use. For now, I am using the
-        relaxation of allowing xi to be a real number
+        relaxation of allowing xi to be a real number. The node with the highest
+        estimate is expanded first (the PriorityQueue pops the lowest priority,
+        so the estimate is negated). Nodes are stored in a NodePool, and each
+        popped node is released once its children are pushed, so the pool only
+        keeps the queued nodes and their ancestors. Budget, callback and bound
+        work as in depth_first_branch_bound.
+
+        If max_frontier is given, the priority queue is not allowed to grow
+        beyond that many nodes: while it has no room for the two children of
+        a node, the popped nodes are solved with a depth-first dive (which
+        only keeps its current path) instead of pushing their children, so
+        memory stays bounded.
         """
         # Relaxation and optimal estimation
-        Item = namedtuple("Item", ['index', 'density', 'weight', 'value'])
-        items = []
-        for item in self.items:
-            items.append(
-                Item(
-                    item.index,
-                    item.value/float(item.weight),
-                    item.weight,
-                    item.value
-                )
-            )
-        items = sorted(items, key=attrgetter('density'), reverse=True)
+        items = self.density_sorted_items()
+        best_taken, best_solution_value = self.greedy_local_search()
+        stats = self.search_stats()
+        capacity = self.search_capacity()
+        bound = self.search_bound(items, stats, bound, capacity)
+        budget = SearchBudget(time_limit, node_limit, callback, stats)
 
+        pool = NodePool()
         pq = PriorityQueue()
-        root = KnapsackNode(0, self.capacity, optimistic_estimate(items, self.capacity))
-        pq.push(root, root.estimate)
-        best_solution_value = 0
-        solution_node = None
+        root = pool.add(0, capacity, bound.estimate(0, capacity))
+        pq.push(root, -pool.estimate[root])
+        root_bound = pool.estimate[root]
+        budget.improved(best_solution_value, best_taken, root_bound)
         while not pq.isEmpty():
+            if budget.expired():
+                break
             node = pq.pop()
-            if node.depth == self.item_count:
-                if node.value > best_solution_value:
-                    best_solution_value = node.value
-                    solution_node = node
-
-            elif node.estimate > best_solution_value:
-                item = items[node.depth]
-                neighbors = node.expand(
-                    item.value,
-                    item.weight,
-                    optimistic_estimate(items[node.depth+1:], self.capacity, self.capacity - node.room, node.value),
-                    items[node.depth].index
+            depth = pool.depth[node]
+            value = pool.value[node]
+            if depth == self.item_count:
+                if value > best_solution_value:
+                    best_solution_value = value
+                    best_taken = pool.taken(node, items, len(self.items))
+                    budget.improved(value, best_taken, root_bound)
+
+            elif (pool.estimate[node] > best_solution_value and max_frontier is not None
+                    and len(pq.heap) + 2 > max_frontier):
+                dive_value, assigned = depth_first_dive(
+                    items, bound, depth, pool.room[node], value,
+                    pool.assignment(node, len(items)), best_solution_value, budget
                 )
-                for neighbor in reversed(neighbors):
-                    if neighbor.room >= 0 and neighbor.estimate > best_solution_value:
-                        pq.push(neighbor, neighbor.estimate)
+                if assigned is not None:
+                    best_solution_value = dive_value
+                    best_taken = [0]*len(self.items)
+                    for item, x in zip(items, assigned):
+                        best_taken[item.index] = x
+                    budget.improved(best_solution_value, best_taken, root_bound)
+                if budget.stopped:
+                    pq.push(node, -pool.estimate[node])
+                    continue
+
+            elif pool.estimate[node] > best_solution_value:
+                item = items[depth]
+                room = pool.room[node]
+                if item.weight <= room:
+                    left = pool.add(value + item.value, room - item.weight, pool.estimate[node], node, depth + 1, 1)
+                    pq.push(left, -pool.estimate[left])
+                else:
+                    stats.pruned_infeasible += 1
+                right_estimate = bound.estimate(depth + 1, room, value)
+                if right_estimate > best_solution_value:
+                    right = pool.add(value, room, right_estimate, node, depth + 1, 0)
+                    pq.push(right, -right_estimate)
+                else:
+                    stats.pruned_bound += 1
+                if len(pq.heap) > stats.max_frontier:
+                    stats.max_frontier = len(pq.heap)
+
+            else:
+                stats.pruned_bound += 1
+            pool.release(node)
+
+        frontier = [-priority for (priority, _, _) in pq.heap]
+        self.incumbent = budget.finish(best_solution_value, best_taken, root_bound, frontier)
+        return (best_taken, best_solution_value)
+
+    def parallel_branch_bound(self, processes=None, split_depth=None, time_limit=None, bound=None):
+        """
+        Parallel depth-first branch and bound. The search tree is split at
+        split_depth (by default, deep enough to have about 8 subproblems per
+        process), and the subtrees that may improve the greedy_local_search
+        solution are solved by a multiprocessing pool, best estimate first.
+        The workers share the best value found, so a solution found in one
+        subtree prunes the others. bound works as in depth_first_branch_bound.
+        The final Incumbent is kept in self.incumbent.
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        items = self.density_sorted_items()
+        best_taken, best_solution_value = self.greedy_local_search()
+        capacity = self.search_capacity()
+        bound = (bound or self.bound)(items, capacity)
+        budget = SearchBudget(time_limit, stats=self.search_stats())
+        root_bound = bound.estimate(0, capacity)
+        budget.improved(best_solution_value, None, root_bound)
+
+        if split_depth is None:
+            split_depth = 0
+            while 2**split_depth < 8*processes:
+                split_depth += 1
+        split_depth = min(split_depth, len(items))
+
+        # Nodes at split_depth (depth, room, value, assigned) that can improve
+        # the greedy solution
+        subproblems = []
+        stack = Stack()
+        stack.push((0, capacity, 0, ()))
+        while not stack.isEmpty():
+            depth, room, value, prefix = stack.pop()
+            if bound.estimate(depth, room, value) <= best_solution_value:
+                continue
+            if depth == split_depth:
+                subproblems.append((depth, room, value, prefix))
+                continue
+            item = items[depth]
+            stack.push((depth + 1, room, value, prefix + (0,)))
+            if item.weight <= room:
+                stack.push((depth + 1, room - item.weight, value + item.value, prefix + (1,)))
+        subproblems.sort(key=lambda s: bound.estimate(s[0], s[1], s[2]), reverse=True)
+
+        deadline = None if time_limit is None else budget.start + time_limit
+        shared_best = multiprocessing.Value('l', best_solution_value)
+        pool = multiprocessing.Pool(
+            processes, _init_parallel_worker, (items, bound, shared_best, deadline)
+        )
+        try:
+            for value, assigned, stopped, stats in pool.imap_unordered(_search_subproblem, subproblems):
+                budget.stopped = budget.stopped or stopped
+                budget.nodes += stats.expanded
+                budget.stats.add(stats)
+                if assigned is not None and value > best_solution_value:
+                    budget.improved(value, None, root_bound)
+                    best_solution_value = value
+                    best_taken = [0]*len(self.items)
+                    for item, x in zip(items, assigned):
+                        best_taken[item.index] = x
+        finally:
+            pool.terminate()
+            pool.join()
+
+        self.incumbent = budget.finish(best_solution_value, best_taken, root_bound, [])
+        return (best_taken, best_solution_value)
 
-        value = solution_node.value
+    def core_solver(self, core_size=CORE_SIZE, method='lazy_depth_first_branch_bound', time_limit=None, bound=None):
+        """
+        Expanding core algorithm. In density order, the items far before the
+        critical item are usually taken, and the ones far after it are not. So
+        only a core (starting with core_size items at each side of the
+        critical item) is solved exactly with the given method, fixing the
+        other items to their LP value. The result is optimal if none of the
+        items outside the core can be flipped to improve it (see can_fix),
+        otherwise those items are added to the core and it is solved again.
+        If time_limit is given, it is shared by all the core solves, and the
+        best solution found is returned when it runs out. The core solves use
+        the given bound class (or self.bound). The final Incumbent is kept in
+        self.incumbent.
+        """
+        budget = SearchBudget(time_limit, stats=self.search_stats())
+        items = self.density_sorted_items()
+        position, weight, value = critical_item(items, self.capacity)
         taken = [0]*len(self.items)
-        while solution_node.parent is not None:
-            taken[solution_node.index] = solution_node.assigned
-            solution_node = solution_node.parent
+        if position is None:
+            for item in items:
+                taken[item.index] = 1
+            self.incumbent = budget.report(value, taken, value, True)
+            return (taken, value)
+
+        critical = items[position]
+        scaled_bound = value*critical.weight + critical.value*(self.capacity - weight)
+        in_core = set(xrange(max(0, position - core_size), min(len(items), position + core_size + 1)))
+        while True:
+            positions = sorted(in_core)
+            fixed = [p for p in xrange(position) if p not in in_core]
+            fixed_weight = sum(items[p].weight for p in fixed)
+            fixed_value = sum(items[p].value for p in fixed)
+            core = [Item(i, items[p].value, items[p].weight) for i, p in enumerate(positions)]
+            knapsack = Knapsack(core, len(core), self.capacity - fixed_weight, self.dp_backend,
+                                bound or self.bound, self.log_interval, self.profile)
+            if time_limit is None:
+                core_taken, core_value = getattr(knapsack, method)()
+            else:
+                remaining = max(0.0, time_limit - budget.elapsed())
+                core_taken, core_value = getattr(knapsack, method)(time_limit=remaining)
+            value = fixed_value + core_value
+            budget.nodes += knapsack.stats.expanded
+            budget.stats.add(knapsack.stats)
+            budget.improved(value, None, value)
+
+            if knapsack.incumbent is not None and not knapsack.incumbent.optimal:
+                break
+            expand = [
+                p for p in xrange(len(items))
+                if p not in in_core and not can_fix(items[p], critical, scaled_bound, value)
+            ]
+            if not expand:
+                break
+            in_core.update(expand)
+
+        for p in fixed:
+            taken[items[p].index] = 1
+        for i, p in enumerate(positions):
+            taken[items[p].index] = core_taken[i]
+        if knapsack.incumbent is not None and not knapsack.incumbent.optimal:
+            self.incumbent = budget.report(value, taken, scaled_bound//critical.weight)
+        else:
+            self.incumbent = budget.report(value, taken, value, True)
         return (taken, value)
 
+    def compare_bounds(self, method='lazy_depth_first_branch_bound',
+                       bounds=(DantzigBound, MartelloTothBound, EnumerativeBound), **kwargs):
+        """
+        Runs the branch and bound method once with each bound class, and
+        returns a dict from the class name to the SearchStats.as_dict() of its
+        search, plus extra_pruned: how many fewer nodes it expanded than the
+        first bound.
+        """
+        results = {}
+        baseline = None
+        for bound in bounds:
+            getattr(self, method)(bound=bound, **kwargs)
+            result = self.stats.as_dict()
+            if baseline is None:
+                baseline = result['expanded']
+            result['extra_pruned'] = baseline - result['expanded']
+            results[bound.__name__] = result
+        return results
 
-    def hybrid_solver(self):
+    def portfolio_solver(self, engines=('dp', 'depth_first', 'best_first', 'greedy'), time_limit=None):
         """
-        This solver is a hybrid one. For now it checks whether the problem
-        is solvable by DP (by not using DP when the size is too big), and if
-        not, just tries a greedy approach.
+        Races several engines (keys of PORTFOLIO_ENGINES), each one in its own
+        process, and keeps the best solution they report. Everything is stopped
+        as soon as an exact engine finishes, or the best solution reaches the
+        root LP bound (rounded down), as it is then known to be optimal. If
+        time_limit is given, the best solution found by then is returned. The
+        final Incumbent is kept in self.incumbent, and the engine that found
+        the solution in self.selection.
+
+        An engine whose process exits without its 'done' message (e.g. a
+        MemoryError in the DP) counts as finished. It is reported to stderr,
+        and listed in self.selection['failed'].
         """
-        if self.capacity*self.item_count <= MAX_ALLOWED_MEMORY:
-            #return self.dynamic_programming()
-            return self.depth_first_branch_bound()
-            #return self.greedy_density()
-            #return self.best_first_branch_bound()
+        budget = SearchBudget(time_limit, stats=self.search_stats())
+        items = self.density_sorted_items()
+        position, weight, value = critical_item(items, self.capacity)
+        upper = value
+        if position is not None:
+            critical = items[position]
+            upper += critical.value*(self.capacity - weight)//critical.weight
+
+        queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=_run_portfolio_engine, args=(self, engine, queue, time_limit))
+            for engine in engines
+        ]
+        for process in processes:
+            process.daemon = True
+            process.start()
+
+        best_taken = [0]*len(self.items)
+        best_value = 0
+        winner = None
+        optimal = False
+        done = set()
+        failed = []
+        try:
+            while len(done) + len(failed) < len(processes) and not optimal:
+                timeout = PORTFOLIO_POLL
+                if time_limit is not None:
+                    remaining = time_limit - budget.elapsed()
+                    if remaining <= 0:
+                        break
+                    timeout = min(timeout, remaining)
+                # The messages of a process are flushed before it exits, so
+                # the ones that had exited before an empty wait never sent
+                # 'done'
+                exited = [
+                    (engine, process.exitcode) for engine, process in zip(engines, processes)
+                    if process.exitcode is not None and engine not in done and engine not in failed
+                ]
+                try:
+                    kind, engine, value, taken, exact = queue.get(timeout=timeout)
+                except Queue.Empty:
+                    for engine, exitcode in exited:
+                        sys.stderr.write("portfolio engine %s exited with code %d\n" % (engine, exitcode))
+                        failed.append(engine)
+                    continue
+                if value > best_value or winner is None:
+                    best_taken, best_value, winner = taken, value, engine
+                    budget.improved(value, None, upper)
+                if kind == 'done':
+                    done.add(engine)
+                    if exact:
+                        best_taken, best_value, winner = taken, value, engine
+                        optimal = True
+                optimal = optimal or best_value >= upper
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+        self.incumbent = budget.report(best_value, best_taken, best_value if optimal else upper, optimal)
+        self.selection = {
+            'engine': winner,
+            'predicted': None,
+            'actual': budget.elapsed(),
+            'item_count': len(self.items),
+            'capacity': self.capacity,
+            'failed': failed,
+        }
+        return (best_taken, best_value)
+
+    def hybrid_solver(self, time_limit=None):
+        """
+        This solver is a hybrid one. It predicts the time of each engine with
+        estimate_costs, and runs the cheapest one. DP engines can not be
+        stopped, so if time_limit is given, they are only used when they are
+        predicted to finish before it, otherwise the core solver is used, and
+        it returns the best solution found when the time runs out.
+
+        The prediction and the actual time are kept in self.selection, and
+        appended to CALIBRATION_LOG (and CALIBRATION_FILE, if set) to adjust
+        ENGINE_SPEED and BB_EXPONENT later.
+        """
+        costs = self.estimate_costs()
+        if time_limit is not None:
+            costs = dict((engine, cost) for engine, cost in costs.items()
+                         if engine == 'core' or cost <= time_limit)
+        engine = min(costs, key=costs.get)
+
+        start = time.time()
+        if engine == 'core':
+            solution = self.core_solver(time_limit=time_limit)
         else:
-            #return self.dynamic_programming()
-            return self.depth_first_branch_bound()
-            #return self.greedy_density()
-            #return self.best_first_branch_bound()
+            solution = getattr(self, DP_BACKENDS[engine])()
+
+        self.selection = {
+            'engine': engine,
+            'predicted': costs[engine],
+            'actual': time.time() - start,
+            'item_count': len(self.items),
+            'capacity': self.capacity,
+        }
+        CALIBRATION_LOG.append(self.selection)
+        if CALIBRATION_FILE is not None:
+            with open(CALIBRATION_FILE, 'a') as calibration_file:
+                calibration_file.write(json.dumps(self.selection) + '\n')
+        return solution
 
 # Unit testing
 if __name__ == "__main__":
@@ -362,8 +2216,18 @@ if __name__ == "__main__":
     print knapsack.greedy_most_valuable()
     print knapsack.greedy_density()
     print knapsack.dynamic_programming()
+    print knapsack.dynamic_programming_compact()
+    print knapsack.dynamic_programming_numpy()
+    print knapsack.dynamic_programming_hirschberg()
+    print knapsack.dynamic_programming_sparse()
+    print knapsack.dynamic_programming_bitset()
+    print knapsack.dynamic_programming_by_value()
     print knapsack.depth_first_branch_bound()
+    print knapsack.lazy_depth_first_branch_bound()
     print knapsack.best_first_branch_bound()
+    print knapsack.parallel_branch_bound()
+    print knapsack.solve_reduced()
+    print knapsack.core_solver()
 
 
     # Example 2
@@ -377,8 +2241,18 @@ if __name__ == "__main__":
     print knapsack.greedy_most_valuable()
     print knapsack.greedy_density()
     print knapsack.dynamic_programming()
+    print knapsack.dynamic_programming_compact()
+    print knapsack.dynamic_programming_numpy()
+    print knapsack.dynamic_programming_hirschberg()
+    print knapsack.dynamic_programming_sparse()
+    print knapsack.dynamic_programming_bitset()
+    print knapsack.dynamic_programming_by_value()
     print knapsack.depth_first_branch_bound()
+    print knapsack.lazy_depth_first_branch_bound()
     print knapsack.best_first_branch_bound()
+    print knapsack.parallel_branch_bound()
+    print knapsack.solve_reduced()
+    print knapsack.core_solver()
 
     # This is the first lecture example
     item_count = 7
@@ -393,8 +2267,18 @@ if __name__ == "__main__":
     print knapsack.greedy_most_valuable()
     print knapsack.greedy_density()
     print knapsack.dynamic_programming()
+    print knapsack.dynamic_programming_compact()
+    print knapsack.dynamic_programming_numpy()
+    print knapsack.dynamic_programming_hirschberg()
+    print knapsack.dynamic_programming_sparse()
+    print knapsack.dynamic_programming_bitset()
+    print knapsack.dynamic_programming_by_value()
     print knapsack.depth_first_branch_bound()
+    print knapsack.lazy_depth_first_branch_bound()
     print knapsack.best_first_branch_bound()
+    print knapsack.parallel_branch_bound()
+    print knapsack.solve_reduced()
+    print knapsack.core_solver()
 
     item_count = 3
     capacity = 10
@@ -406,5 +2290,15 @@ if __name__ == "__main__":
     print knapsack.greedy_most_valuable()
     print knapsack.greedy_density()
     print knapsack.dynamic_programming()
+    print knapsack.dynamic_programming_compact()
+    print knapsack.dynamic_programming_numpy()
+    print knapsack.dynamic_programming_hirschberg()
+    print knapsack.dynamic_programming_sparse()
+    print knapsack.dynamic_programming_bitset()
+    print knapsack.dynamic_programming_by_value()
     print knapsack.depth_first_branch_bound()
+    print knapsack.lazy_depth_first_branch_bound()
     print knapsack.best_first_branch_bound()
+    print knapsack.parallel_branch_bound()
+    print knapsack.solve_reduced()
+    print knapsack.core_solver()
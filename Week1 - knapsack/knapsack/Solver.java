@@ -13,31 +13,80 @@ public class Solver {
      */
     public static void main(String[] args) {
         try {
+            for(String arg : args){
+                if(arg.equals("-server")){
+                    serve();
+                    return;
+                }
+            }
             solve(args);
         } catch (IOException e) {
             e.printStackTrace();
         }
     }
     
+    /**
+     * Worker mode, used by the JavaWorkerPool of solverJava.py: solves the
+     * instances sent through the standard input until it is closed. Each
+     * instance is framed as its length in bytes on its own line followed by
+     * its text, and each solution is written back with the same framing.
+     */
+    public static void serve() throws IOException {
+        DataInputStream input = new DataInputStream(new BufferedInputStream(System.in));
+        OutputStream output = new BufferedOutputStream(System.out);
+        String header;
+        while ((header = readHeader(input)) != null) {
+            byte[] instance = new byte[Integer.parseInt(header.trim())];
+            input.readFully(instance);
+
+            List<String> lines = new ArrayList<String>();
+            BufferedReader reader = new BufferedReader(new StringReader(new String(instance, "US-ASCII")));
+            String line = null;
+            while (( line = reader.readLine()) != null){
+                lines.add(line);
+            }
+
+            byte[] solution = solution(lines).getBytes("US-ASCII");
+            output.write((solution.length + "\n").getBytes("US-ASCII"));
+            output.write(solution);
+            output.flush();
+        }
+    }
+
+    /**
+     * Reads the length line of a frame, or returns null at the end of the input
+     */
+    private static String readHeader(InputStream input) throws IOException {
+        StringBuilder header = new StringBuilder();
+        int c;
+        while ((c = input.read()) != '\n') {
+            if (c == -1)
+                return null;
+            header.append((char) c);
+        }
+        return header.toString();
+    }
+
     /**
      * Read the instance, solve it, and print the solution in the standard output
      */
     public static void solve(String[] args) throws IOException {
         String fileName = null;
         
-        // get the temp file name
+        // get the temp file name (without it, the instance is read from the
+        // standard input)
         for(String arg : args){
             if(arg.startsWith("-file=")){
                 fileName = arg.substring(6);
             } 
         }
-        if(fileName == null)
-            return;
         
         // read the lines out of the file
         List<String> lines = new ArrayList<String>();
 
-        BufferedReader input =  new BufferedReader(new FileReader(fileName));
+        BufferedReader input = fileName == null
+            ? new BufferedReader(new InputStreamReader(System.in))
+            : new BufferedReader(new FileReader(fileName));
         try {
             String line = null;
             while (( line = input.readLine()) != null){
@@ -47,8 +96,15 @@ public class Solver {
         finally {
             input.close();
         }
-        
-        
+
+        System.out.print(solution(lines));
+    }
+
+    /**
+     * Solves the instance given by the lines of its file, and returns the
+     * solution in the specified output format
+     */
+    public static String solution(List<String> lines) {
         // parse the data in the file
         String[] firstLine = lines.get(0).split("\\s+");
         int items = Integer.parseInt(firstLine[0]);
@@ -82,10 +138,12 @@ public class Solver {
         }
         
         // prepare the solution in the specified output format
-        System.out.println(value+" 0");
+        StringBuilder solution = new StringBuilder();
+        solution.append(value+" 0\n");
         for(int i=0; i < items; i++){
-            System.out.print(taken[i]+" ");
+            solution.append(taken[i]+" ");
         }
-        System.out.println("");        
+        solution.append("\n");
+        return solution.toString();
     }
 }
\ No newline at end of file
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the knapsack engines over the instances in the data directory.
+Every (instance, engine) pair runs in its own process, so the peak RSS of a
+run is not mixed with the others and a run that takes too long can be
+killed. The results are written to a JSON and a CSV report, sorted by
+instance and engine, so the reports of two versions can be diffed.
+
+Usage: python benchmark.py [-e ENGINE ...] [-i INSTANCE ...] [-t TIMEOUT]
+"""
+
+import argparse
+import csv
+from inspect import getargspec
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+from Knapsack import Knapsack
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Engines run by default, the Knapsack method names
+ENGINES = [
+    'trivial_greedy',
+    'greedy_more_items',
+    'greedy_most_valuable',
+    'greedy_density',
+    'dynamic_programming',
+    'dp_solver',
+    'depth_first_branch_bound',
+    'lazy_depth_first_branch_bound',
+    'best_first_branch_bound',
+    'core_solver',
+    'hybrid_solver',
+]
+
+# Seconds given to each run, anytime engines get it as their time_limit and
+# the others are killed when it expires (plus TIMEOUT_GRACE)
+TIMEOUT = 60
+TIMEOUT_GRACE = 5
+
+# Address space allowed to each run, so the table DP fails with a
+# MemoryError instead of swapping on the big instances
+MEMORY_LIMIT = 4*1024**3
+
+FIELDS = ['instance', 'item_count', 'capacity', 'engine', 'status', 'value',
+    'best_known', 'gap', 'optimal', 'feasible', 'time', 'peak_rss_kb', 'nodes',
+    'pruned_bound', 'pruned_infeasible', 'max_frontier']
+
+
+def _run_engine(file_location, engine, timeout, memory_limit, queue):
+    """
+    Runs one engine over one instance (in a child process), and puts its
+    result in the queue.
+    """
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    result = {'status': 'ok'}
+    try:
+        knapsack = Knapsack.from_file(file_location)
+        method = getattr(knapsack, engine)
+        kwargs = {}
+        if 'time_limit' in getargspec(method).args:
+            kwargs['time_limit'] = timeout
+        start = time.time()
+        taken, value = method(**kwargs)
+        result['time'] = time.time() - start
+        result['value'] = value
+        result['feasible'] = (
+            sum(item.weight for item in knapsack.items if taken[item.index]) <= knapsack.capacity and
+            sum(item.value for item in knapsack.items if taken[item.index]) == value
+        )
+        if knapsack.stats is not None:
+            result['nodes'] = knapsack.stats.expanded
+            result['pruned_bound'] = knapsack.stats.pruned_bound
+            result['pruned_infeasible'] = knapsack.stats.pruned_infeasible
+            result['max_frontier'] = knapsack.stats.max_frontier
+        if knapsack.incumbent is not None:
+            result['optimal'] = knapsack.incumbent.optimal
+    except MemoryError:
+        result['status'] = 'memory'
+    except Exception as e:
+        result['status'] = 'error: %s' % e
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(result)
+
+
+def run_benchmark(instances, engines=ENGINES, timeout=TIMEOUT, memory_limit=MEMORY_LIMIT, best_known=None):
+    """
+    Runs every engine over every instance (file names in DATA_DIRECTORY) and
+    returns the list of result rows (dicts with the FIELDS keys). The best
+    known value of an instance is the one in best_known (a dict from the
+    instance name), or the best value found by the engines otherwise.
+    """
+    best_known = dict(best_known or {})
+    rows = []
+    for instance in instances:
+        file_location = os.path.join(DATA_DIRECTORY, instance)
+        with open(file_location) as input_data_file:
+            item_count, capacity = map(int, input_data_file.readline().split())
+        instance_rows = []
+        for engine in engines:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_run_engine, args=(file_location, engine, timeout, memory_limit, queue)
+            )
+            start = time.time()
+            process.start()
+            process.join(timeout + TIMEOUT_GRACE)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+                result = {'status': 'timeout'}
+            elif queue.empty():
+                result = {'status': 'crashed (exit code %d)' % process.exitcode}
+            else:
+                result = queue.get()
+            result.setdefault('time', time.time() - start)
+            result.update({
+                'instance': instance,
+                'item_count': item_count,
+                'capacity': capacity,
+                'engine': engine,
+            })
+            instance_rows.append(result)
+            print "%-16s %-30s %-10s %12s %8.2fs" % (
+                instance, engine, result['status'][:10], result.get('value', '-'), result['time'])
+
+        values = [row['value'] for row in instance_rows if row.get('feasible')]
+        best = best_known.get(instance, max(values) if values else None)
+        for row in instance_rows:
+            row['best_known'] = best
+            if best and row.get('feasible'):
+                row['gap'] = (best - row['value'])/float(best)
+            rows.append(dict((field, row.get(field)) for field in FIELDS))
+    return rows
+
+
+def write_reports(rows, json_location=None, csv_location=None):
+    rows = sorted(rows, key=lambda row: (row['instance'], row['engine']))
+    if json_location is not None:
+        with open(json_location, 'w') as json_file:
+            json.dump(rows, json_file, indent=1, sort_keys=True, separators=(',', ': '))
+            json_file.write('\n')
+    if csv_location is not None:
+        with open(csv_location, 'wb') as csv_file:
+            writer = csv.DictWriter(csv_file, FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmark of the knapsack engines.')
+    parser.add_argument('-e', '--engines', nargs='+', default=ENGINES,
+        help='Knapsack methods to run (default: %(default)s)')
+    parser.add_argument('-i', '--instances', nargs='+',
+        help='instance files in the data directory (default: all of them)')
+    parser.add_argument('-t', '--timeout', type=float, default=TIMEOUT,
+        help='seconds given to each run (default: %(default)s)')
+    parser.add_argument('-m', '--memory-limit', type=int, default=MEMORY_LIMIT,
+        help='bytes of address space of each run, 0 for no limit (default: %(default)s)')
+    parser.add_argument('-b', '--best-known',
+        help='JSON file with the best known value of each instance')
+    parser.add_argument('--json', default='benchmark.json',
+        help='JSON report (default: %(default)s)')
+    parser.add_argument('--csv', default='benchmark.csv',
+        help='CSV report (default: %(default)s)')
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    instances = args.instances or sorted(os.listdir(DATA_DIRECTORY))
+    best_known = None
+    if args.best_known is not None:
+        with open(args.best_known) as best_known_file:
+            best_known = json.load(best_known_file)
+    rows = run_benchmark(instances, args.engines, args.timeout, args.memory_limit, best_known)
+    write_reports(rows, args.json, args.csv)
@@ -1,39 +1,26 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from collections import namedtuple
-from Knapsack import Knapsack
-Item = namedtuple("Item", ['index', 'value', 'weight'])
+import multiprocessing
+import os
 
-def solve_it(input_data):
-    # Modify this code to run your optimization algorithm
-
-    # parse the input
-    lines = input_data.split('\n')
-
-    firstLine = lines[0].split()
-    item_count = int(firstLine[0])
-    capacity = int(firstLine[1])
+from Knapsack import Knapsack, parse_instance
+from cache import SolutionCache, source_version
 
-    items = []
+# Solutions are cached on disk, and the cache is invalidated when the solver
+# code changes (see cache.py)
+solution_cache = SolutionCache(source_version('solver.py', 'Knapsack.py'))
 
-    for i in range(1, item_count+1):
-        line = lines[i]
-        parts = line.split()
-        items.append(Item(i-1, int(parts[0]), int(parts[1])))
+@solution_cache.cached
+def solve_it(input_data):
+    # Modify this code to run your optimization algorithm
 
-    # a trivial greedy algorithm for filling the knapsack
-    # it takes items in-order until the knapsack is full
-    value = 0
-    weight = 0
-    taken = [0]*len(items)
+    # parse the input (into columns of values and weights, see parse_instance)
+    item_count, capacity, items = parse_instance(input_data)
+    return solve_instance(item_count, capacity, items)
 
-    for item in items:
-        if weight + item.weight <= capacity:
-            taken[item.index] = 1
-            value += item.value
-            weight += item.weight
 
+def solve_instance(item_count, capacity, items):
     # This was added by myself to the original code, just for trying different approaches
     knapsack = Knapsack(items, item_count, capacity)
 
@@ -46,12 +33,73 @@ def solve_it(input_data):
     return output_data
 
 
+def _solve_columns(job):
+    file_location, item_count, capacity, items = job
+    return file_location, solve_instance(item_count, capacity, items)
+
+
+def solve_batch(instances, processes=None):
+    """
+    Solves many instances (a directory, or a list of files) with a pool of
+    processes, and yields (file_location, output_data) as each one is solved.
+    Instances with the same text (up to whitespace) are solved only once, and
+    the biggest files are scheduled first, so the slowest instances do not
+    end up running alone at the end. Solutions go through solution_cache as
+    in solve_it.
+
+    Each file is read once, and parsed in this process (while the pool is
+    already solving the first ones), so the workers get the columns of
+    values and weights and do not read or parse anything.
+    """
+    if isinstance(instances, basestring):
+        instances = [os.path.join(instances, file_name) for file_name in sorted(os.listdir(instances))]
+
+    duplicates = {}
+    texts = {}
+    keys = {}
+    for file_location in instances:
+        with open(file_location, 'r') as input_data_file:
+            input_data = input_data_file.read()
+        key = solution_cache.key(input_data)
+        if key in keys:
+            duplicates[keys[key]].append(file_location)
+        else:
+            keys[key] = file_location
+            duplicates[file_location] = [file_location]
+            texts[file_location] = input_data
+
+    for file_location in list(texts):
+        output_data = solution_cache.get(texts[file_location])
+        if output_data is not None:
+            del texts[file_location]
+            for duplicate in duplicates[file_location]:
+                yield duplicate, output_data
+    pending = sorted(texts, key=lambda file_location: len(texts[file_location]), reverse=True)
+    jobs = ((file_location,) + parse_instance(texts[file_location]) for file_location in pending)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for file_location, output_data in pool.imap_unordered(_solve_columns, jobs):
+            solution_cache.put(texts.pop(file_location), output_data)
+            for duplicate in duplicates[file_location]:
+                yield duplicate, output_data
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 if __name__ == '__main__':
     import sys
     if len(sys.argv) > 1:
         file_location = sys.argv[1].strip()
+        if os.path.isdir(file_location):
+            # Batch mode, every instance in the directory
+            for instance_location, output_data in solve_batch(file_location):
+                print(instance_location)
+                print(output_data)
+            sys.exit(0)
         with open(file_location, 'r') as input_data_file:
             input_data = input_data_file.read()
         print(solve_it(input_data))
     else:
-        print('This test requires an input file.  Please select one from the data directory. (i.e. python solver.py ./data/ks_4_0)')
+        print('This test requires an input file.  Please select one from the data directory. (i.e. python solver.py ./data/ks_4_0), or a directory to solve all of its instances.')
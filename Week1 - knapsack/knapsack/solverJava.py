@@ -1,37 +1,217 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+from multiprocessing.pool import ThreadPool
 import os
+import Queue
+import select
 from subprocess import Popen, PIPE
+import sys
+import time
+
+from Knapsack import Knapsack, parse_instance
+
+# 'python' runs the same greedy algorithm as Solver.java in this process
+# (no JVM startup), 'java' runs the Java Solver, and 'java_pool' sends the
+# instance to a long-lived Java Solver of java_pool(). It can be chosen with
+# the KNAPSACK_BACKEND environment variable
+BACKEND = os.environ.get('KNAPSACK_BACKEND', 'python')
+
+# Command of the Java Solver in worker mode
+JAVA_WORKER_COMMAND = ['java', 'Solver', '-server']
+
+# Stand-in worker that speaks the same protocol with the 'python' backend
+# (see serve), so JavaWorkerPool can be checked without a JVM. Its solutions
+# do not end with a newline, unlike the ones of Solver.java
+PYTHON_WORKER_COMMAND = [sys.executable, os.path.abspath(__file__), '-server']
+
+class SolverTimeout(Exception):
+    pass
+
+class JavaWorkerPool(object):
+    """
+    Keeps size Java Solver processes alive (in worker mode, see Solver.serve),
+    so the JVM startup is only paid once per worker. An instance is sent
+    through the worker's stdin as its length in bytes on a line followed by
+    its text, and the solution comes back through its stdout with the same
+    framing. A worker is replaced by a new one after max_jobs instances (to
+    bound the memory it may leak), or when it does not answer in timeout
+    seconds, in which case SolverTimeout is raised.
+
+    solve can be called from several threads, each call takes an idle worker
+    (or waits for one). It can be checked against the stand-in Python worker
+    with python solverJava.py -check.
+    """
+    def __init__(self, size=2, max_jobs=100, timeout=None, command=JAVA_WORKER_COMMAND):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.command = command
+        self.idle = Queue.Queue()
+        for _ in xrange(size):
+            self.idle.put(self.start_worker())
+
+    def start_worker(self):
+        worker = Popen(self.command, stdin=PIPE, stdout=PIPE)
+        worker.jobs = 0
+        return worker
+
+    def stop_worker(self, worker, kill=False):
+        try:
+            if kill:
+                worker.kill()
+            else:
+                worker.stdin.close()
+        except (IOError, OSError):
+            pass
+        worker.wait()
+
+    def read(self, worker, size, deadline, data=''):
+        """
+        Reads from the worker's stdout until data has size bytes (or until a
+        line ends, if size is None).
+        """
+        fd = worker.stdout.fileno()
+        while (size is None and '\n' not in data) or (size is not None and len(data) < size):
+            timeout = None if deadline is None else deadline - time.time()
+            if timeout is not None and timeout <= 0:
+                raise SolverTimeout()
+            if not select.select([fd], [], [], timeout)[0]:
+                raise SolverTimeout()
+            chunk = os.read(fd, 65536 if size is None else size - len(data))
+            if not chunk:
+                raise IOError('Java Solver worker exited (%s)' % worker.poll())
+            data += chunk
+        return data
+
+    def solve(self, input_data, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        worker = self.idle.get()
+        try:
+            deadline = None if timeout is None else time.time() + timeout
+            worker.stdin.write('%d\n%s' % (len(input_data), input_data))
+            worker.stdin.flush()
+            # The header may come with the beginning of the solution
+            data = self.read(worker, None, deadline)
+            header, data = data.split('\n', 1)
+            output_data = self.read(worker, int(header), deadline, data)
+            worker.jobs += 1
+        except BaseException:
+            # The worker may be in the middle of a frame, so it can not be
+            # reused
+            self.stop_worker(worker, True)
+            self.idle.put(self.start_worker())
+            raise
 
-def solve_it(input_data):
+        if worker.jobs >= self.max_jobs:
+            self.stop_worker(worker)
+            worker = self.start_worker()
+        self.idle.put(worker)
+        return output_data.strip()
 
-    # Writes the inputData to a temporay file
+    def solve_many(self, instances, timeout=None):
+        """
+        Solves the instances (input data strings) using all the workers,
+        and yields their solutions in order.
+        """
+        threads = ThreadPool(self.size)
+        try:
+            for output_data in threads.imap(lambda input_data: self.solve(input_data, timeout), instances):
+                yield output_data
+        finally:
+            threads.terminate()
 
-    tmp_file_name = 'tmp.data'
-    tmp_file = open(tmp_file_name, 'w')
-    tmp_file.write(input_data)
-    tmp_file.close()
+    def close(self):
+        for _ in xrange(self.size):
+            self.stop_worker(self.idle.get())
 
-    # Runs the command: java Solver -file=tmp.data
+    def __enter__(self):
+        return self
 
-    process = Popen(['java', 'Solver', '-file=' + tmp_file_name], stdout=PIPE)
-    (stdout, stderr) = process.communicate()
+    def __exit__(self, *exc_info):
+        self.close()
 
-    # removes the temporay file
-    os.remove(tmp_file_name)
+# Pool used by the 'java_pool' backend, started on its first use
+_java_pool = None
+
+def java_pool():
+    global _java_pool
+    if _java_pool is None:
+        _java_pool = JavaWorkerPool(
+            int(os.environ.get('JAVA_WORKERS', 2)),
+            int(os.environ.get('JAVA_WORKER_JOBS', 100))
+        )
+    return _java_pool
+
+def solve_it(input_data, backend=None):
+    backend = backend or BACKEND
+    if backend == 'java':
+        return solve_it_java(input_data)
+    if backend == 'java_pool':
+        return java_pool().solve(input_data)
+
+    # In order greedy, as Solver.java, over the parsed columns
+    item_count, capacity, items = parse_instance(input_data)
+    taken, value = Knapsack(items, item_count, capacity).trivial_greedy()
+
+    output_data = str(value) + ' ' + str(0) + '\n'
+    output_data += ' '.join(map(str, taken))
+    return output_data
+
+def solve_it_java(input_data):
+
+    # Runs the command: java Solver, piping the inputData through its
+    # standard input (so there is no temporary file to share between
+    # concurrent calls)
+
+    process = Popen(['java', 'Solver'], stdin=PIPE, stdout=PIPE)
+    (stdout, stderr) = process.communicate(input_data)
 
     return stdout.strip()
 
+def serve():
+    """
+    Worker mode of PYTHON_WORKER_COMMAND, the same as Solver.serve: solves
+    the instances framed in the standard input (length line and text) with
+    the 'python' backend until it is closed, and writes back each solution
+    with the same framing.
+    """
+    while True:
+        header = sys.stdin.readline()
+        if not header:
+            break
+        output_data = solve_it(sys.stdin.read(int(header)), 'python')
+        sys.stdout.write('%d\n%s' % (len(output_data), output_data))
+        sys.stdout.flush()
+
+def check_pool(file_locations):
+    """
+    Solves the instance files with a JavaWorkerPool of stand-in Python
+    workers, and checks that they give the same solutions as solve_it. A
+    worker that does not answer raises SolverTimeout.
+    """
+    instances = []
+    for file_location in file_locations:
+        with open(file_location, 'r') as input_data_file:
+            instances.append(input_data_file.read())
+    with JavaWorkerPool(2, max_jobs=3, timeout=30, command=PYTHON_WORKER_COMMAND) as pool:
+        for file_location, input_data, output_data in zip(file_locations, instances, pool.solve_many(instances)):
+            assert output_data == solve_it(input_data, 'python').strip(), file_location
+            print file_location, 'ok'
 
-import sys
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 1 and sys.argv[1] == '-server':
+        serve()
+    elif len(sys.argv) > 1 and sys.argv[1] == '-check':
+        data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+        check_pool(sys.argv[2:] or [
+            os.path.join(data_directory, file_name) for file_name in sorted(os.listdir(data_directory))
+        ])
+    elif len(sys.argv) > 1:
         file_location = sys.argv[1].strip()
         with open(file_location, 'r') as input_data_file:
             input_data = input_data_file.read()
         print solve_it(input_data)
     else:
         print('This test requires an input file.  Please select one from the data directory. (i.e. python solver.py ./data/ks_4_0)')
-
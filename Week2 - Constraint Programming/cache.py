@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of the solutions returned by solve_it, so solving the same
+instance again (e.g. when submitting several times) is instant. The key of
+an instance is a hash of its text with the whitespace normalized, and of a
+version tag of the solver (by default, a hash of its source files), so the
+cached solutions are not used anymore when the solver changes.
+"""
+
+from functools import wraps
+import hashlib
+import os
+import tempfile
+
+CACHE_DIRECTORY = os.environ.get(
+    'SOLUTION_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.solution_cache')
+)
+
+# Maximum number of cached solutions, the least recently used ones are
+# removed when it is exceeded
+CACHE_SIZE = 256
+
+
+def source_version(*file_names):
+    """
+    Version tag built from the contents of the given source files (relative
+    to this directory).
+    """
+    digest = hashlib.sha1()
+    for file_name in file_names:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name), 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+class SolutionCache(object):
+    """
+    Each solution is stored in its own file (named by the key of its
+    instance) in directory. Reading a solution touches its file, so the
+    modification times give the LRU order used for eviction. Files are
+    written to a temporary file and renamed, so concurrent solvers never read
+    a partial solution.
+    """
+    def __init__(self, version, directory=CACHE_DIRECTORY, size=CACHE_SIZE):
+        self.version = version
+        self.directory = directory
+        self.size = size
+
+    def key(self, input_data):
+        digest = hashlib.sha1(self.version)
+        digest.update(' '.join(input_data.split()))
+        return digest.hexdigest()
+
+    def get(self, input_data):
+        """
+        Returns the cached solution of the instance, or None.
+        """
+        file_location = os.path.join(self.directory, self.key(input_data))
+        try:
+            with open(file_location, 'rb') as solution_file:
+                output_data = solution_file.read()
+            os.utime(file_location, None)
+        except (IOError, OSError):
+            return None
+        return output_data
+
+    def put(self, input_data, output_data):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, temp_location = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+            with os.fdopen(fd, 'wb') as solution_file:
+                solution_file.write(output_data)
+            os.rename(temp_location, os.path.join(self.directory, self.key(input_data)))
+            self.evict()
+        except (IOError, OSError):
+            # The cache is only an optimization, a solution that can not be
+            # stored is just solved again next time
+            pass
+
+    def evict(self):
+        """
+        Removes the least recently used solutions beyond size.
+        """
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith('.tmp'):
+                continue
+            file_location = os.path.join(self.directory, file_name)
+            try:
+                entries.append((os.path.getmtime(file_location), file_location))
+            except OSError:
+                pass
+        entries.sort()
+        for _, file_location in entries[:max(0, len(entries) - self.size)]:
+            try:
+                os.remove(file_location)
+            except OSError:
+                pass
+
+    def cached(self, solve_it):
+        """
+        Decorator of solve_it, that returns the cached solution if there is
+        one, and caches the solution otherwise.
+        """
+        @wraps(solve_it)
+        def cached_solve_it(input_data):
+            output_data = self.get(input_data)
+            if output_data is None:
+                output_data = solve_it(input_data)
+                self.put(input_data, output_data)
+            return output_data
+        return cached_solve_it
@@ -1,7 +1,13 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 from GraphColoring import *
+from cache import SolutionCache, source_version
 
+# Solutions are cached on disk, and the cache is invalidated when the solver
+# code changes (see cache.py)
+solution_cache = SolutionCache(source_version('solver.py', 'GraphColoring.py', 'ConstraintProgramming.py', 'utils.py'))
+
+@solution_cache.cached
 def solve_it(input_data):
     # Modify this code to run your optimization algorithm
 